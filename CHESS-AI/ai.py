@@ -1,153 +1,412 @@
 import chessboard as cb
-import random
+import evaluation
+import transposition
+import bitbase
 import cProfile
 import pstats
 import timeit
 import time
+import threading
+
+# score of a checkmate, mates found closer to the root score higher
+MATESCORE = 30000
+
+# deepest ply the search keeps killer moves for
+MAXPLY = 64
+
+# piece values used to order captures by most valuable victim / least valuable attacker, indexed by piece type (the
+# evaluation uses evaluation.PIECEVALUES). An en passant capture lands on an empty square, so EMPTY counts as a pawn.
+PIECEVALUES = (1, 1, 3, 3, 5, 9, 200, 0)
+
+# evaluation.PIECEVALUES indexed by piece type, for delta pruning. EMPTY again counts as a pawn.
+MATERIALVALUES = (evaluation.PIECEVALUES['p'],) + tuple(evaluation.PIECEVALUES[piece] for piece in "pnbrqk") + (0,)
+
+# ordering scores: the hash/PV move, then captures, then killers, then the other quiet moves by history
+HASHMOVESCORE = 1000000
+CAPTURESCORE = 100000
+KILLERSCORE = 90000
+
+# score of a position the bitbases say is won, below every mate score so a mate the search finds is still preferred
+BITBASEWIN = 20000
+
+# delta pruning margin of the quiescence search in centipawns: a capture is skipped when even winning the captured
+# piece plus this margin cannot bring the score up to alpha
+DELTAMARGIN = 200
+
 class AI:
 
-    def __init__(self, isBlack):
+    # the AI searches on boardObj if one is given and on a new Board in the starting position otherwise
+    # it uses the transposition table tt if one is given (e.g. one shared with other processes) and a new one otherwise
+    # and plays from the opening book (a book.OpeningBook) if one is given
+    # positions with three pieces are scored by the endgame bitbases (a bitbase.Bitbases) if they are given
+    def __init__(self, isBlack, ttSizeMB=16, boardObj=None, tt=None, book=None, bitbases=None):
 
-        self.boardObj = cb.Board()
-        self.boardObj.board2Bitboard()
+        if boardObj is None:
+            boardObj = cb.Board()
+            boardObj.board2Bitboard()
+        self.boardObj = boardObj
         self.isBlack = isBlack
+        self.tt = tt if tt is not None else transposition.TranspositionTable(ttSizeMB)
+        self.book = book
+        self.bitbases = bitbases
+        self.rootBestMove = None
+        self.rootInBitbases = False
 
+        # search budget and statistics, see search(). nodes counts the main search, qnodes the quiescence search
+        self.nodes = 0
+        self.qnodes = 0
+        self.stopped = False
+        # set by stop(), possibly from another thread, and cleared only by clearStop(), never by the search itself
+        self.stopRequested = threading.Event()
+        # optional flag shared with other processes (e.g. a multiprocessing.RawValue), the search stops when its value
+        # is set
+        self.stopFlag = None
+        self.startTime = 0
+        self.deadline = None
+        self.maxNodes = None
+        self.completedDepth = 0
+        # principal variation of the last completed iteration, as moves and as {zobrist key: move}
+        self.pv = []
+        self.pvKeys = {}
 
+        # move ordering: two killer moves per ply (quiet moves that caused a beta cutoff) and a butterfly history
+        # table indexed by [color][end][start] that is increased by depth * depth on every quiet beta cutoff
+        self.killers = [[None, None] for ply in range(MAXPLY)]
+        self.history = [0] * (2 * 64 * 64)
+        # beta cutoffs and how many of them came from the first move searched
+        self.cutoffs = 0
+        self.firstMoveCutoffs = 0
+
+
+    # Returns the score of the position from the point of view of the given color, in centipawns.
+    # The material and piece-square part is kept up to date by the Board in push() and pop() (Board.evalScore).
+    # Mobility is estimated setwise: the number of squares in each color's attack map not occupied by its own pieces.
+    # Checkmate and stalemate are left to the search, which sees that there are no legal moves.
     def evaluate(self, isBlack):
-        king = self.boardObj.bitboard2Index(self.boardObj.bitboards['k']) if isBlack else self.boardObj.bitboard2Index(self.boardObj.bitboards['K'])
-        if self.boardObj.check(king, isBlack) == -1:
-            return 1000
-        
-        selfMaterial, enemyMaterial, selfMobility, enemyMobility = 0, 0, 0, 0
-
-        if isBlack:
-            selfMaterial, enemyMaterial, selfMobility, enemyMobility = self.countMaterial()
-        else:
-            enemyMaterial, selfMaterial, enemyMobility, selfMobility = self.countMaterial()
-
-        return selfMaterial - enemyMaterial + (selfMobility - enemyMobility)
-    
-    
-    def countMaterial(self):
-        blackMaterial, whiteMaterial, blackMobility, whiteMobility = 0, 0, 0, 0
-        for type in ('p', 'n', 'b', 'r', 'q', 'k'):
-            pieces = self.boardObj.bitboards[type]
-            while pieces > 0:
-
-                index = self.boardObj.bitboard2Index(pieces)
-
-                possibleMoves = self.boardObj.legalMoves(index)
-                while possibleMoves > 0:
-                    blackMobility += 1
-                    possibleMoves &= possibleMoves - 1
-
-                if type == 'p':
-                    blackMaterial += 1
-                elif type == 'n':
-                    blackMaterial += 3
-                elif type == 'b':
-                    blackMaterial += 3
-                elif type == 'r':
-                    blackMaterial += 5
-                elif type == 'q':
-                    blackMaterial += 9
-                else:
-                    blackMaterial += 200
-                pieces &= pieces - 1
-                
-        for type in ('P', 'N', 'B', 'R', 'Q', 'K'):
-            pieces = self.boardObj.bitboards[type]
-            while pieces > 0:
-
-                index = self.boardObj.bitboard2Index(pieces)
-
-                possibleMoves = self.boardObj.legalMoves(index)
-                while possibleMoves > 0:
-                    whiteMobility += 1
-                    possibleMoves ^= 0b1 << self.boardObj.bitboard2Index(possibleMoves)
-
-                if type == 'P':
-                    whiteMaterial += 1
-                elif type == 'N':
-                    whiteMaterial += 3
-                elif type == 'B':
-                    whiteMaterial += 3
-                elif type == 'R':
-                    whiteMaterial += 5
-                elif type == 'Q':
-                    whiteMaterial += 9
-                else:
-                    whiteMaterial += 200
-                pieces &= pieces - 1
-
-        return blackMaterial, whiteMaterial, blackMobility, whiteMobility
-    
+        pieceBbs = self.boardObj.pieceBbs
+        score = self.boardObj.evalScore + evaluation.MOBILITYWEIGHT * (
+            (pieceBbs[cb.WHITEATTACKS] & ~pieceBbs[cb.WHITE]).bit_count() - (pieceBbs[cb.BLACKATTACKS] & ~pieceBbs[cb.BLACK]).bit_count())
+        return -score if isBlack else score
 
     def getMoves(self, isBlack):
-        moves = []
-        pieces = self.boardObj.bitboards['black'] if isBlack else self.boardObj.bitboards['white']
-        while pieces > 0:
-            index = self.boardObj.bitboard2Index(pieces)
-            possibleMoves = self.boardObj.legalMoves(index)
-            while possibleMoves > 0:
-                moves.append((index, self.boardObj.bitboard2Index(possibleMoves)))
-                possibleMoves &= possibleMoves - 1
-            pieces &= pieces - 1
-        return moves
+        return self.boardObj.generateLegalMoves(isBlack)
 
     # Check all legal moves for their score and return the best move and score
-    def minimax(self, depth, alpha, beta, aiTurn = True):
-        bestMove = -1
-        color = aiTurn and self.isBlack
-        moves = self.getMoves(color)
+    # the score is from the point of view of the side to move
+    def minimax(self, depth, alpha, beta):
+        self.startSearch(None, None)
+        self.completedDepth = depth
+        score = self.negamax(depth, alpha, beta, 0)
+        return (self.rootBestMove, score)
+
+    # Iterative deepening: searches to depth 1, 2, 3, ... up to max_depth and stops early when time_ms milliseconds
+    # have passed or max_nodes positions have been searched. An unfinished iteration is thrown away, so the result is
+    # (bestMove, score, depth) of the deepest search that completed. Depth 1 always completes, so there is always a move
+    # if the side to move has one. Each iteration searches the principal variation of the previous one first.
+    # If progress is given, it is called as progress(depth, score, move, nodes) after every completed iteration.
+    # start_depth skips the shallower iterations, which the helpers of a parallel search use to search different depths.
+    # With an opening book, a book move of the position is returned right away as (move, 0, 0).
+    def search(self, time_ms=None, max_nodes=None, max_depth=64, progress=None, start_depth=1):
+        self.startSearch(time_ms, max_nodes)
+        if self.book is not None:
+            move = self.book.weightedMove(self.boardObj)
+            if move is not None:
+                return (move, 0, 0)
+        result = (None, 0, 0)
+        for depth in range(start_depth, max_depth + 1):
+            self.rootBestMove = None
+            score = self.negamax(depth, -float('inf'), float('inf'), 0)
+            if self.stopped or self.rootBestMove is None:
+                break
+            self.completedDepth = depth
+            result = (self.rootBestMove, score, depth)
+            line = self.principalVariation(self.rootBestMove, depth)
+            self.pv = [move for key, move in line]
+            self.pvKeys = dict(line)
+            if progress is not None:
+                progress(depth, score, self.rootBestMove, self.nodes + self.qnodes)
+            # a forced mate was found, searching deeper will not change the move
+            if abs(score) > MATESCORE - 1000:
+                break
+        return result
+
+    # Asks a running search to stop as soon as possible. It can be called from another thread than the one searching.
+    # The search returns the result of the deepest iteration it completed, or no move if it had not completed one.
+    # The request stays until clearStop(), so a stop sent before the search thread gets going is not lost, and a search
+    # started while it stands stops at once.
+    def stop(self):
+        self.stopRequested.set()
+
+    # Withdraws a stop() before the next search. Call it on the thread that starts the search, before starting it.
+    def clearStop(self):
+        self.stopRequested.clear()
+
+    # Gives a search that was started without a budget, such as one pondering on the opponent's time, the budget it would
+    # have had from the start: it stops time_ms milliseconds after it started or after max_nodes positions in all, which
+    # may be at once. The time spent pondering on the right move is then saved from the reply, and the search keeps the
+    # depths it completed. It can be called from another thread than the one searching.
+    def ponderHit(self, time_ms=None, max_nodes=None):
+        if max_nodes is not None:
+            self.maxNodes = max_nodes
+        if time_ms is not None:
+            self.deadline = self.startTime + time_ms / 1000
+
+    def startSearch(self, time_ms, max_nodes):
+        self.tt.newSearch()
+        self.rootBestMove = None
+        self.nodes = 0
+        self.qnodes = 0
+        self.stopped = False
+        self.startTime = time.perf_counter()
+        self.deadline = None if time_ms is None else self.startTime + time_ms / 1000
+        self.maxNodes = max_nodes
+        self.completedDepth = 0
+        self.pv = []
+        self.pvKeys = {}
+        self.rootInBitbases = self.bitbases is not None and self.bitbases.probe(self.boardObj) is not None
+        self.killers = [[None, None] for ply in range(MAXPLY)]
+        # older history still says something about the position, so it is only halved
+        self.history = [value >> 1 for value in self.history]
+        self.cutoffs = 0
+        self.firstMoveCutoffs = 0
+
+    # fraction of beta cutoffs caused by the first move searched, a measure of how good the move ordering is
+    def firstMoveCutoffRate(self):
+        if self.cutoffs == 0:
+            return 0.0
+        return self.firstMoveCutoffs / self.cutoffs
+
+    # returns True if the move is neither a capture nor a promotion (castling is quiet)
+    def isQuiet(self, move):
+        return self.boardObj.mailbox[move >> 6 & 63] == cb.EMPTY and (move >> 14 == cb.NORMALFLAG or move >> 14 == cb.CASTLINGFLAG)
+
+    # sorts moves in place so the most promising are searched first:
+    # the hash/PV move, then captures and promotions by most valuable victim (plus the piece promoted to) / least
+    # valuable attacker, then the killer moves of this ply, then the other quiet moves by their history score
+    def orderMoves(self, moves, hashMove, ply):
+        mailbox = self.boardObj.mailbox
+        killers = self.killers[ply] if ply < MAXPLY else (None, None)
+        history = self.history
+        color = 0 if self.boardObj.whiteToMove else 4096
+        scores = {}
+        for move in moves:
+            if move == hashMove:
+                scores[move] = HASHMOVESCORE
+            elif not self.isQuiet(move):
+                score = CAPTURESCORE + 10 * PIECEVALUES[mailbox[move >> 6 & 63] & 7] - PIECEVALUES[mailbox[move & 63] & 7]
+                if move >> 14 == cb.PROMOTIONFLAG:
+                    score += 10 * PIECEVALUES[cb.PROMOTIONTYPES[move >> 12 & 3]]
+                scores[move] = score
+            elif move == killers[0]:
+                scores[move] = KILLERSCORE
+            elif move == killers[1]:
+                scores[move] = KILLERSCORE - 1
+            else:
+                scores[move] = history[color + (move & 4095)]
+        moves.sort(key=scores.__getitem__, reverse=True)
+
+    # remembers a quiet move that caused a beta cutoff
+    def updateKillersAndHistory(self, move, depth, ply):
+        if ply < MAXPLY:
+            killers = self.killers[ply]
+            if killers[0] != move:
+                killers[1] = killers[0]
+                killers[0] = move
+        color = 0 if self.boardObj.whiteToMove else 4096
+        self.history[color + (move & 4095)] += depth * depth
+
+    # checked every 16 nodes by negamax, the first iteration is never stopped by the time or node budget
+    def outOfBudget(self):
+        if self.stopRequested.is_set() or self.stopFlag is not None and self.stopFlag.value:
+            return True
+        if self.completedDepth == 0:
+            return False
+        if self.maxNodes is not None and self.nodes + self.qnodes >= self.maxNodes:
+            return True
+        return self.deadline is not None and time.perf_counter() >= self.deadline
+
+    # follows the best moves stored in the transposition table from the root, starting with firstMove
+    # returns a list of (zobrist key, move) with at most maxLength moves
+    def principalVariation(self, firstMove, maxLength):
+        board = self.boardObj
+        line = []
+        move = firstMove
+        while move is not None and len(line) < maxLength:
+            if move not in self.getMoves(not board.whiteToMove):
+                break
+            line.append((board.zobristKey, move))
+            board.push(move)
+            # stop at a repeated position, the stored moves would loop
+            if any(key == board.zobristKey for key, pvMove in line):
+                break
+            entry = self.tt.probe(board.zobristKey)
+            move = entry[3] or None if entry is not None else None
+        for i in range(len(line)):
+            board.pop()
+        return line
+
+    # alpha-beta search in negamax form: the score of a position is from the point of view of the side to move, so the
+    # score of a move is minus the score of the position it leads to.
+    # The transposition table is probed first. A stored result of a search at least as deep ends the search when its
+    # bound allows it, and the stored move is searched first otherwise.
+    def negamax(self, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 15 == 0 and self.outOfBudget():
+            self.stopped = True
+        if self.stopped:
+            return 0
+        board = self.boardObj
+        key = board.zobristKey
+        alphaOrig = alpha
+        hashMove = None
+        entry = self.tt.probe(key)
+        if entry is not None:
+            ttDepth, ttScore, ttBound, ttMove = entry
+            hashMove = ttMove or None
+            if ttDepth >= depth and (ply > 0 or hashMove is not None):
+                ttScore = self.scoreFromTT(ttScore, ply)
+                if ttBound == transposition.EXACT or ttBound == transposition.LOWERBOUND and ttScore >= beta or ttBound == transposition.UPPERBOUND and ttScore <= alpha:
+                    if ply == 0:
+                        self.rootBestMove = hashMove
+                    return ttScore
+
+        # A position in the bitbases is scored by them instead of searched. When the root is already in the bitbases,
+        # only the positions at the horizon are, and the search is left to make progress towards the mate.
+        if ply > 0 and self.bitbases is not None and (depth == 0 or not self.rootInBitbases) and \
+                (board.pieceBbs[cb.WHITE] | board.pieceBbs[cb.BLACK]).bit_count() <= 3:
+            result = self.bitbases.probe(board)
+            if result is not None:
+                if result == bitbase.LOSS and board.inCheck(not board.whiteToMove) and not self.getMoves(not board.whiteToMove):
+                    return -MATESCORE + ply
+                return self.bitbaseScore(result)
+
         if depth == 0:
-            return (None, self.evaluate(color))
-        if aiTurn:
-            print('aiTurn')
-            bestScore = -float('inf')
-            for move in moves:
-
-                boardCopy = self.boardObj.board.copy()
-                bitboardsCopy = self.boardObj.bitboards.copy()
-                self.boardObj.makeMove(move[0], move[1])
-
-                score = self.minimax(depth - 1, alpha, beta, not aiTurn)
-                if score[1] > bestScore:
-                    bestScore = score[1]
-                    bestMove = move
-                elif score[1] == bestScore:
-                    bestMove = random.choice((bestMove, move))
-                if bestScore > beta:
-                    break
-                alpha = max(bestScore, alpha)
+            return self.quiescence(alpha, beta, ply)
 
-                self.boardObj.board = boardCopy
-                self.boardObj.bitboards = bitboardsCopy
-        else:
-            print("not")
+        moves = self.getMoves(not board.whiteToMove)
+        if not moves:
+            # checkmate (prefer the fastest mate) or stalemate
+            return -MATESCORE + ply if board.inCheck(not board.whiteToMove) else 0
+        # the principal variation of the previous iteration goes first, then the stored move
+        self.orderMoves(moves, self.pvKeys.get(key, hashMove), ply)
+
+        bestScore = -float('inf')
+        bestMove = None
+        for moveNumber, move in enumerate(moves):
+            board.push(move)
+            score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            board.pop()
+            if self.stopped:
+                return 0
+            if score > bestScore:
+                bestScore = score
+                bestMove = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        self.cutoffs += 1
+                        if moveNumber == 0:
+                            self.firstMoveCutoffs += 1
+                        if self.isQuiet(move):
+                            self.updateKillersAndHistory(move, depth, ply)
+                        break
 
-            bestScore = float('inf')
-            for move in moves:  # Iterate through moves# If the move is available, then check its value
-                # newMove = bitboard of new move
+        if bestScore <= alphaOrig:
+            bound = transposition.UPPERBOUND
+        elif bestScore >= beta:
+            bound = transposition.LOWERBOUND
+        else:
+            bound = transposition.EXACT
+        self.tt.store(key, depth, self.scoreToTT(bestScore, ply), bound, bestMove or 0)
+        if ply == 0:
+            self.rootBestMove = bestMove
+        return bestScore
 
-                boardCopy = self.boardObj.board.copy()
-                bitboardsCopy = self.boardObj.bitboards.copy()
-                self.boardObj.makeMove(move[0], move[1])
+    # Scores a bitbase result from the point of view of the side to move. A draw is 0. A win is BITBASEWIN plus the value
+    # of the extra piece and a bonus for progress, since the bitbases do not say how far the mate is and the search has to
+    # find the way: the pawn advanced, or the losing king driven to the edge with few squares left and the winning king
+    # close. The piece-square tables are left out, their king wants to stay home.
+    def bitbaseScore(self, result):
+        if result == bitbase.DRAW:
+            return 0
+        board = self.boardObj
+        pieceBbs = board.pieceBbs
+        strong = cb.WHITE if pieceBbs[cb.WHITE].bit_count() == 2 else cb.BLACK
+        strongKing = pieceBbs[strong | cb.KING].bit_length() - 1
+        weakKing = pieceBbs[strong ^ cb.BLACK | cb.KING].bit_length() - 1
+        extra = (pieceBbs[strong] ^ pieceBbs[strong | cb.KING]).bit_length() - 1
+        score = BITBASEWIN + MATERIALVALUES[board.mailbox[extra] & 7]
+        if board.mailbox[extra] & 7 == cb.PAWN:
+            score += 50 * (extra // 8 if strong == cb.WHITE else 7 - extra // 8)
+        else:
+            weakFile, weakRank = weakKing % 8, weakKing // 8
+            edge = max(3 - weakFile, weakFile - 4) + max(3 - weakRank, weakRank - 4)
+            distance = abs(strongKing % 8 - weakFile) + abs(strongKing // 8 - weakRank)
+            freeSquares = (board.kingMoves[weakKing] & ~pieceBbs[strong | cb.ATTACKS]).bit_count()
+            score += 10 * edge + 4 * (14 - distance) + 8 * (8 - freeSquares)
+        return score if result == bitbase.WIN else -score
 
-                score = self.minimax(depth - 1, alpha, beta, not aiTurn)
-                if score[1] < bestScore:
-                    bestScore = score[1]
-                    bestMove = move
-                elif score[1] == bestScore:
-                    bestMove = random.choice((bestMove, move))
+    # Quiescence search: at the horizon of the main search only captures (and pawn moves to the last rank) are searched
+    # until the position is quiet, so a capture just before the horizon is not scored as if it could not be answered.
+    # The side to move may also "stand pat" and keep the static evaluation, which is a lower bound on its score since
+    # it is never forced to capture. Captures that cannot raise the score to alpha even after winning the captured piece
+    # are skipped (delta pruning). A side in check can neither stand pat nor pick its moves: every evasion is searched,
+    # and with none it is mated. Past MAXPLY a position in check is scored statically, so checks can not go on forever.
+    def quiescence(self, alpha, beta, ply):
+        self.qnodes += 1
+        if self.qnodes & 15 == 0 and self.outOfBudget():
+            self.stopped = True
+        if self.stopped:
+            return 0
+        board = self.boardObj
+        isBlack = not board.whiteToMove
+        standPat = None
+        if ply < MAXPLY and board.inCheck(isBlack):
+            moves = self.getMoves(isBlack)
+            if not moves:
+                return -MATESCORE + ply
+        else:
+            standPat = self.evaluate(isBlack)
+            if standPat >= beta:
+                return standPat
+            if standPat > alpha:
+                alpha = standPat
+            moves = board.captureMoves()
 
-                if alpha < bestScore:
+        mailbox = board.mailbox
+        self.orderMoves(moves, None, MAXPLY)
+        for move in moves:
+            if standPat is not None and move >> 14 != cb.PROMOTIONFLAG and \
+                    standPat + MATERIALVALUES[mailbox[move >> 6 & 63] & 7] + DELTAMARGIN < alpha:
+                continue
+            board.push(move)
+            if board.inCheck(isBlack):
+                board.pop()
+                continue
+            score = -self.quiescence(-beta, -alpha, ply + 1)
+            board.pop()
+            if self.stopped:
+                return 0
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
                     break
-                beta = min(bestScore, beta)
+        return alpha
+
+    # mate scores are stored relative to the position they are stored for rather than to the root
+    def scoreToTT(self, score, ply):
+        if score > MATESCORE - 1000:
+            return score + ply
+        if score < -MATESCORE + 1000:
+            return score - ply
+        return score
 
-                self.boardObj.board = boardCopy
-                self.boardObj.bitboards = bitboardsCopy
-        return (bestMove, bestScore)
+    def scoreFromTT(self, score, ply):
+        if score > MATESCORE - 1000:
+            return score - ply
+        if score < -MATESCORE + 1000:
+            return score + ply
+        return score
 
 #ai = AI(False)
 
@@ -0,0 +1,126 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import chessboard as cb
+import ai
+import bitbase
+
+# Batch analysis: searches many positions on a pool of worker processes and streams one JSON object per position as
+# soon as its search is over, e.g.
+#   python analysis.py positions.fen --workers 4 --movetime 500 > results.jsonl
+#   {"id": 3, "fen": "...", "bestmove": "e2e4", "score": 34, "depth": 5, "nodes": 20985, "time_ms": 501}
+# id is the number of the position in the input (from 0), since results come out in the order the searches finish.
+
+# the AI of this worker process and the search budget of every position, set by initWorker
+workerAI = None
+workerBudget = None
+
+
+# Runs once in each worker process. The AI (with its move generation tables, transposition table and the endgame
+# bitbases if they have been generated) is kept for every position the worker searches.
+def initWorker(ttSizeMB, time_ms, max_nodes, max_depth):
+    global workerAI, workerBudget
+    workerAI = ai.AI(False, ttSizeMB, bitbases=bitbase.openBitbases())
+    workerBudget = (time_ms, max_nodes, max_depth)
+
+
+# Searches one position in a worker process and returns its result as a dict. A position the Board cannot set up or
+# search, or one without exactly one king of each colour, gives a result with an "error" instead.
+def analysePosition(positionId, fen):
+    result = {"id": positionId, "fen": fen}
+    start = time.perf_counter()
+    try:
+        board = workerAI.boardObj
+        board.fen2Board(fen)
+        # the move generation and the search assume one king of each colour
+        if board.pieceBbs[cb.WHITEKING].bit_count() != 1 or board.pieceBbs[cb.BLACKKING].bit_count() != 1:
+            raise ValueError("the position does not have one king of each colour")
+        workerAI.isBlack = not board.whiteToMove
+        move, score, depth = workerAI.search(*workerBudget)
+        status = board.gameStatus() if move is None else cb.INPLAY
+    except Exception as error:
+        result["error"] = f"{type(error).__name__}: {error}"
+        return result
+    if status == cb.CHECKMATE:
+        score = -ai.MATESCORE
+    result["bestmove"] = None if move is None else cb.move2Uci(move)
+    result["score"] = score
+    result["depth"] = depth
+    result["nodes"] = workerAI.nodes + workerAI.qnodes
+    result["time_ms"] = int((time.perf_counter() - start) * 1000)
+    return result
+
+
+# yields (id, fen) for the lines of the stream that hold a position, skipping empty lines and # comments
+def readPositions(stream):
+    positionId = 0
+    for line in stream:
+        fen = line.strip()
+        if not fen or fen.startswith("#"):
+            continue
+        yield positionId, fen
+        positionId += 1
+
+
+# Searches every (id, fen) of positions on a pool of workers processes and yields the results as they finish.
+# At most maxInFlight positions are queued or being searched at any time: positions is only read further when a result
+# has been taken, so a slow consumer or a huge input does not pile up work in memory.
+def analyse(positions, workers=None, maxInFlight=None, time_ms=1000, max_nodes=None, max_depth=64, ttSizeMB=16):
+    workers = max(1, workers or os.cpu_count() or 1)
+    maxInFlight = max(1, maxInFlight or 2 * workers)
+    with ProcessPoolExecutor(workers, initializer=initWorker,
+                             initargs=(ttSizeMB, time_ms, max_nodes, max_depth)) as pool:
+        pending = set()
+        for positionId, fen in positions:
+            if len(pending) >= maxInFlight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(pool.submit(analysePosition, positionId, fen))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="search a file of FEN positions and write one JSON result per line")
+    parser.add_argument("input", nargs="?", default="-", help="file with one FEN per line (default: standard input)")
+    parser.add_argument("--output", "-o", default="-", help="file to write the results to (default: standard output)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per cpu)")
+    parser.add_argument("--in-flight", type=int, help="positions queued or searched at once (default: 2 per worker)")
+    parser.add_argument("--movetime", type=int, help="milliseconds per position (default 1000 without --depth or --nodes)")
+    parser.add_argument("--depth", type=int, default=64, help="deepest depth to search")
+    parser.add_argument("--nodes", type=int, help="positions to search per position")
+    parser.add_argument("--hash", type=int, default=16, help="transposition table size per worker in MB (default 16)")
+    options = parser.parse_args(args)
+
+    time_ms = options.movetime
+    if time_ms is None and options.nodes is None and options.depth == 64:
+        time_ms = 1000
+
+    source = sys.stdin if options.input == "-" else open(options.input)
+    output = sys.stdout if options.output == "-" else open(options.output, "w")
+    count = 0
+    start = time.perf_counter()
+    try:
+        for result in analyse(readPositions(source), options.workers, options.in_flight, time_ms, options.nodes,
+                              options.depth, options.hash):
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+            count += 1
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    elapsed = time.perf_counter() - start
+    print(f"{count} positions in {elapsed:.3f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,233 @@
+import argparse
+import mmap
+import os
+import time
+import chessboard as cb
+
+# Endgame bitbases for king and queen, king and rook and king and pawn against a lone king, made by retrograde analysis
+# (python bitbase.py generates them, nothing is downloaded).
+#
+# Each table stores one bit per position: whether the side with the extra piece (the strong side) wins. The other side
+# can never win, so with the side to move this gives win, draw or loss. Positions are seen from the strong side as if
+# it were white (a black strong side is flipped vertically) and indexed with the board indexes of the mailbox (a1 = 0):
+#   index = side to move (0 strong, 1 weak) << 18 | strong king << 12 | weak king << 6 | square of the extra piece
+# so a table is 2 * 64 * 64 * 64 bits = 64KB. Illegal positions are stored as draws. The tables are probed through mmap,
+# one byte read per probe.
+
+BITBASEDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bitbases")
+# (name, piece type of the extra piece) of each endgame, in the order they are generated: the king and pawn table
+# looks up the queen and rook tables for promotions
+ENDGAMES = (("KQK", cb.QUEEN), ("KRK", cb.ROOK), ("KPK", cb.PAWN))
+TABLESIZE = 2 * 64 * 64 * 64
+WEAKTOMOVE = 1 << 18
+
+# the result of a probe for the side to move
+WIN, DRAW, LOSS = 1, 0, -1
+
+
+class Bitbases:
+
+    # maps the tables found in directory; endgames without a table are not probed
+    def __init__(self, directory=BITBASEDIR):
+        self.tables = {}
+        self.files = []
+        for name, pieceType in ENDGAMES:
+            path = os.path.join(directory, name + ".bin")
+            if not os.path.exists(path) or os.path.getsize(path) != TABLESIZE // 8:
+                continue
+            tableFile = open(path, "rb")
+            self.files.append(tableFile)
+            self.tables[pieceType] = mmap.mmap(tableFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+        for tableFile in self.files:
+            tableFile.close()
+        self.tables = {}
+        self.files = []
+
+    # Returns WIN, DRAW or LOSS for the side to move of board, or None if the position is not in a loaded table.
+    # Bitbases have no counts of moves to mate, so a won position still has to be won by the search.
+    def probe(self, board):
+        pieceBbs = board.pieceBbs
+        if (pieceBbs[cb.WHITE] | pieceBbs[cb.BLACK]).bit_count() != 3:
+            return None
+        strong = cb.WHITE if pieceBbs[cb.WHITE].bit_count() == 2 else cb.BLACK
+        extraBb = pieceBbs[strong] ^ pieceBbs[strong | cb.KING]
+        square = (extraBb & -extraBb).bit_length() - 1
+        table = self.tables.get(board.mailbox[square] & 7)
+        if table is None:
+            return None
+        strongKing = pieceBbs[strong | cb.KING].bit_length() - 1
+        weakKing = pieceBbs[strong ^ cb.BLACK | cb.KING].bit_length() - 1
+        strongToMove = board.whiteToMove == (strong == cb.WHITE)
+        if strong == cb.BLACK:
+            strongKing, weakKing, square = strongKing ^ 56, weakKing ^ 56, square ^ 56
+        index = (0 if strongToMove else WEAKTOMOVE) | strongKing << 12 | weakKing << 6 | square
+        if not table[index >> 3] >> (index & 7) & 1:
+            return DRAW
+        return WIN if strongToMove else LOSS
+
+
+# returns a Bitbases of the tables in directory, or None if there are none
+def openBitbases(directory=BITBASEDIR):
+    bitbases = Bitbases(directory)
+    if not bitbases.tables:
+        return None
+    return bitbases
+
+
+# Works out which positions of the endgame with the given extra piece the strong side wins and returns a bytearray of
+# TABLESIZE flags. promotionTables maps QUEEN and ROOK to the finished tables (as flags) a pawn promotes into.
+#
+# The weak side's positions with no legal move are won when the weak king is in check (mate). Going backwards from
+# every newly won position:
+#   - a strong side position that has a move into a won weak side position is won
+#   - a weak side position is won once all of its legal moves lead to won strong side positions, which is counted
+#     down from its number of legal moves; capturing the piece or stalemate can never be won
+# Each position is expanded once, when it becomes won, through the moves that lead into it ("un-moves").
+def generate(pieceType, promotionTables=None):
+    board = cb.Board()
+    kingMoves = board.kingMoves
+
+    def attacks(square, occupancyBb):
+        if pieceType == cb.PAWN:
+            return board.whitePawnAttacks[square]
+        if pieceType == cb.ROOK:
+            return board.rookMagicAttack(square, occupancyBb)
+        return board.rookMagicAttack(square, occupancyBb) | board.bishopMagicAttack(square, occupancyBb)
+
+    wins = bytearray(TABLESIZE)
+    # legal moves left to refute for each weak side position, or NEVER if it can never be won
+    NEVER = 255
+    counters = bytearray(TABLESIZE)
+    legal = bytearray(TABLESIZE)
+    won = []
+    pieceSquares = range(8, 56) if pieceType == cb.PAWN else range(64)
+
+    for strongKing in range(64):
+        for weakKing in range(64):
+            if weakKing == strongKing or kingMoves[strongKing] & 1 << weakKing:
+                continue
+            for square in pieceSquares:
+                if square == strongKing or square == weakKing:
+                    continue
+                index = strongKing << 12 | weakKing << 6 | square
+                check = attacks(square, 1 << strongKing | 1 << weakKing) & 1 << weakKing
+                # the strong side to move can not have the weak king in check
+                if not check:
+                    legal[index] = 1
+                legal[WEAKTOMOVE | index] = 1
+
+                # count the moves of the weak king
+                count = 0
+                escapes = False
+                targets = kingMoves[weakKing] & ~kingMoves[strongKing]
+                while targets:
+                    target = (targets & -targets).bit_length() - 1
+                    targets &= targets - 1
+                    if target == square:
+                        escapes = True
+                    elif not attacks(square, 1 << strongKing | 1 << target) & 1 << target:
+                        count += 1
+                if escapes or count == 0 and not check:
+                    counters[WEAKTOMOVE | index] = NEVER
+                elif count == 0:
+                    wins[WEAKTOMOVE | index] = 1
+                    won.append(WEAKTOMOVE | index)
+                else:
+                    counters[WEAKTOMOVE | index] = count
+
+                # a pawn on the seventh rank wins if it can promote into a won position
+                if pieceType == cb.PAWN and square >= 48 and not check and legal[index]:
+                    promotionSquare = square + 8
+                    if promotionSquare != strongKing and promotionSquare != weakKing and not wins[index]:
+                        for table in promotionTables.values():
+                            if table[WEAKTOMOVE | strongKing << 12 | weakKing << 6 | promotionSquare]:
+                                wins[index] = 1
+                                won.append(index)
+                                break
+
+    while won:
+        index = won.pop()
+        strongKing, weakKing, square = index >> 12 & 63, index >> 6 & 63, index & 63
+        if index & WEAKTOMOVE:
+            # the strong side moved into this position: with its king or with the piece
+            predecessors = []
+            origins = kingMoves[strongKing] & ~kingMoves[weakKing] & ~(1 << square | 1 << weakKing)
+            while origins:
+                origin = (origins & -origins).bit_length() - 1
+                predecessors.append(origin << 12 | weakKing << 6 | square)
+                origins &= origins - 1
+            occupancyBb = 1 << strongKing | 1 << weakKing
+            if pieceType == cb.PAWN:
+                origins = 0
+                if square >= 16 and not occupancyBb & 1 << (square - 8):
+                    origins = 1 << (square - 8)
+                    if 24 <= square < 32 and not occupancyBb & 1 << (square - 16):
+                        origins |= 1 << (square - 16)
+            else:
+                origins = attacks(square, occupancyBb) & ~occupancyBb
+            while origins:
+                origin = (origins & -origins).bit_length() - 1
+                predecessors.append(strongKing << 12 | weakKing << 6 | origin)
+                origins &= origins - 1
+            for predecessor in predecessors:
+                if legal[predecessor] and not wins[predecessor]:
+                    wins[predecessor] = 1
+                    won.append(predecessor)
+        else:
+            # the weak king moved into this position
+            origins = kingMoves[weakKing] & ~kingMoves[strongKing] & ~(1 << square | 1 << strongKing)
+            while origins:
+                origin = (origins & -origins).bit_length() - 1
+                predecessor = WEAKTOMOVE | strongKing << 12 | origin << 6 | square
+                if legal[predecessor] and counters[predecessor] != NEVER and not wins[predecessor]:
+                    counters[predecessor] -= 1
+                    if counters[predecessor] == 0:
+                        wins[predecessor] = 1
+                        won.append(predecessor)
+                origins &= origins - 1
+    return wins
+
+
+# packs TABLESIZE flags into TABLESIZE / 8 bytes, bit index & 7 of byte index >> 3
+def packFlags(flags):
+    packed = bytearray(TABLESIZE // 8)
+    for index, flag in enumerate(flags):
+        if flag:
+            packed[index >> 3] |= 1 << (index & 7)
+    return packed
+
+
+# generates every table into directory and prints how long each took and how many positions it found won
+def generateAll(directory=BITBASEDIR):
+    os.makedirs(directory, exist_ok=True)
+    tables = {}
+    for name, pieceType in ENDGAMES:
+        start = time.perf_counter()
+        promotionTables = {piece: tables[piece] for piece in (cb.QUEEN, cb.ROOK)} if pieceType == cb.PAWN else None
+        wins = generate(pieceType, promotionTables)
+        tables[pieceType] = wins
+        path = os.path.join(directory, name + ".bin")
+        temporaryPath = f"{path}.{os.getpid()}.tmp"
+        with open(temporaryPath, "wb") as tableFile:
+            tableFile.write(packFlags(wins))
+        os.replace(temporaryPath, path)
+        strongWins = sum(wins[:WEAKTOMOVE])
+        weakLosses = sum(wins[WEAKTOMOVE:])
+        print(f"{name}: {strongWins} wins with the strong side to move, {weakLosses} losses with the weak side to move, "
+              f"{time.perf_counter() - start:.1f}s")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="generate the KQK, KRK and KPK bitbases")
+    parser.add_argument("--dir", default=BITBASEDIR, help="directory to write the tables to")
+    options = parser.parse_args(args)
+    generateAll(options.dir)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,229 @@
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+import chessboard as cb
+import pgn
+from polyglotkeys import RANDOM64
+
+# Opening books in the Polyglot format: a file of 16 byte entries sorted by key, each
+#   key (64 bits) | move (16 bits) | weight (16 bits) | learn (32 bits), big endian
+# The key is the Polyglot hash of the position (see polyglotKey), so books made by other programs work here.
+# The file is read through mmap and searched by binary search, so a probe reads a few pages of it and the book takes
+# no memory of its own beyond the operating system's page cache.
+#   http://hgm.nubati.net/book_format.html
+#   python book.py build games.pgn book.bin --ply 16
+#   python book.py probe book.bin --fen "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+ENTRY = struct.Struct(">QHHI")
+KEY = struct.Struct(">Q")
+
+# the book the GUI plays from, if there is one
+BOOKPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "book.bin")
+
+# the Polyglot promotion field of each piece type, 0 for no promotion
+POLYGLOTPROMOTIONS = {cb.KNIGHT: 1, cb.BISHOP: 2, cb.ROOK: 3, cb.QUEEN: 4}
+# Polyglot writes castling as the king taking its own rook
+POLYGLOTCASTLING = {(4, 6): 7, (4, 2): 0, (60, 62): 63, (60, 58): 56}
+
+
+# Returns the Polyglot key of the position of board. Like the Polyglot format, the en passant file only counts when a
+# pawn of the side to move stands next to the pawn that just moved two squares.
+def polyglotKey(board):
+    key = 0
+    mailbox = board.mailbox
+    pieces = board.pieceBbs[cb.WHITE] | board.pieceBbs[cb.BLACK]
+    while pieces:
+        index = (pieces & -pieces).bit_length() - 1
+        piece = mailbox[index]
+        key ^= RANDOM64[128 * ((piece & 7) - 1) + (0 if piece & cb.BLACK else 64) + index]
+        pieces &= pieces - 1
+    for bit in range(4):
+        if board.castlingRights >> bit & 1:
+            key ^= RANDOM64[768 + bit]
+    if board.whiteToMove:
+        enpassant, pawns = board.blackEnpassant, board.pieceBbs[cb.WHITEPAWN]
+        attackers = board.blackPawnAttacks
+    else:
+        enpassant, pawns = board.whiteEnpassant, board.pieceBbs[cb.BLACKPAWN]
+        attackers = board.whitePawnAttacks
+    if enpassant:
+        index = board.bitboard2Index(enpassant)
+        if attackers[index] & pawns:
+            key ^= RANDOM64[772 + index % 8]
+    if board.whiteToMove:
+        key ^= RANDOM64[780]
+    return key
+
+
+# returns the Polyglot encoding of a move of the Board
+def encodePolyglotMove(move):
+    start, end = cb.moveStart(move), cb.moveEnd(move)
+    if cb.moveFlag(move) == cb.CASTLINGFLAG:
+        end = POLYGLOTCASTLING[(start, end)]
+    return end | start << 6 | POLYGLOTPROMOTIONS.get(cb.movePromotion(move), 0) << 12
+
+
+# returns the legal move of board that a Polyglot move stands for, or None if it is not one
+def decodePolyglotMove(board, polyglotMove):
+    start, end = polyglotMove >> 6 & 63, polyglotMove & 63
+    if polyglotMove >> 12 & 7 > 4:
+        return None
+    # findMove takes a queen for moves that are not promotions
+    promotion = (cb.QUEEN, cb.KNIGHT, cb.BISHOP, cb.ROOK, cb.QUEEN)[polyglotMove >> 12 & 7]
+    if board.mailbox[start] & 7 == cb.KING:
+        for (kingStart, kingEnd), rookStart in POLYGLOTCASTLING.items():
+            if start == kingStart and end == rookStart:
+                end = kingEnd
+    return board.findMove(start, end, promotion)
+
+
+class OpeningBook:
+
+    # opens the Polyglot book at path; close() it, or use the book in a with statement, when done
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as bookFile:
+            size = os.fstat(bookFile.fileno()).st_size
+            self.data = mmap.mmap(bookFile.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.numEntries = size // ENTRY.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    # returns the index of the first entry whose key is not less than key
+    def lowerBound(self, key):
+        data = self.data
+        low, high = 0, self.numEntries
+        while low < high:
+            middle = (low + high) >> 1
+            if KEY.unpack_from(data, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # Returns [(move, weight)] of the book moves of the position of board, in the order of the book (usually heaviest
+    # first). Entries whose move is not legal in the position (from a key collision or a broken book) are left out.
+    def entries(self, board):
+        key = polyglotKey(board)
+        data = self.data
+        entries = []
+        index = self.lowerBound(key)
+        while index < self.numEntries:
+            entryKey, polyglotMove, weight, learn = ENTRY.unpack_from(data, index * ENTRY.size)
+            if entryKey != key:
+                break
+            move = decodePolyglotMove(board, polyglotMove)
+            if move is not None:
+                entries.append((move, weight))
+            index += 1
+        return entries
+
+    # returns a book move for the position of board chosen with probability proportional to its weight, or None if
+    # the position is not in the book
+    def weightedMove(self, board, generator=random):
+        entries = [(move, weight) for move, weight in self.entries(board) if weight > 0]
+        if not entries:
+            return None
+        choice = generator.randrange(sum(weight for move, weight in entries))
+        for move, weight in entries:
+            choice -= weight
+            if choice < 0:
+                return move
+
+    # returns the heaviest book move of the position of board, or None if the position is not in the book
+    def bestMove(self, board):
+        entries = self.entries(board)
+        if not entries:
+            return None
+        return max(entries, key=lambda entry: entry[1])[0]
+
+
+# returns an OpeningBook of the book at path, or None if there is no file there
+def openBook(path=BOOKPATH):
+    if not os.path.exists(path):
+        return None
+    return OpeningBook(path)
+
+
+# Builds a Polyglot book at path from the games of a PGN stream. Every move of the first maxPly plies of each game is
+# counted for the side that played it: 2 points for a win, 1 for a draw and none for a loss or an unknown result,
+# as the Polyglot tool does. Moves played in fewer than minGames games are left out and weights are scaled down to fit
+# 16 bits. Returns (games, entries).
+def buildBook(stream, path, maxPly=16, minGames=1):
+    counts = {}
+    board = cb.Board()
+    games = 0
+    for game in pgn.readGames(stream):
+        points = {"1-0": (2, 0), "0-1": (0, 2), "1/2-1/2": (1, 1)}.get(game.result, (0, 0))
+        try:
+            for ply, (position, move) in enumerate(game.replay(board)):
+                if ply >= maxPly:
+                    break
+                entry = counts.setdefault((polyglotKey(position), encodePolyglotMove(move)), [0, 0])
+                entry[0] += points[0 if position.whiteToMove else 1]
+                entry[1] += 1
+        except ValueError:
+            continue
+        games += 1
+
+    entries = sorted(((key, polyglotMove, score) for (key, polyglotMove), (score, played) in counts.items()
+                      if played >= minGames), key=lambda entry: (entry[0], -entry[2]))
+    scale = max([score for key, polyglotMove, score in entries] + [65535]) / 65535
+    with open(path, "wb") as bookFile:
+        for key, polyglotMove, score in entries:
+            # a move that was played keeps a weight of at least 1, so it can still be chosen
+            bookFile.write(ENTRY.pack(key, polyglotMove, max(1, int(score / scale)), 0))
+    return games, len(entries)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="build and probe Polyglot opening books")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build a book from a PGN file")
+    build.add_argument("pgn", help="PGN file ('-' for standard input)")
+    build.add_argument("book", help="book file to write")
+    build.add_argument("--ply", type=int, default=16, help="plies of each game to use (default 16)")
+    build.add_argument("--min-games", type=int, default=1, help="leave out moves played in fewer games (default 1)")
+    probe = commands.add_parser("probe", help="print the book moves of a position")
+    probe.add_argument("book", help="book file")
+    probe.add_argument("--fen", default=pgn.STARTFEN, help="position to look up (default: the starting position)")
+    options = parser.parse_args(args)
+
+    if options.command == "build":
+        stream = sys.stdin if options.pgn == "-" else open(options.pgn, "r", encoding="utf-8", errors="replace")
+        start = time.perf_counter()
+        try:
+            games, entries = buildBook(stream, options.book, options.ply, options.min_games)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        print(f"{games} games, {entries} entries in {time.perf_counter() - start:.3f}s")
+        return 0
+
+    board = cb.Board()
+    board.fen2Board(options.fen)
+    with OpeningBook(options.book) as book:
+        start = time.perf_counter()
+        entries = book.entries(board)
+        elapsed = time.perf_counter() - start
+        total = sum(weight for move, weight in entries)
+        for move, weight in entries:
+            print(f"{cb.move2Uci(move):<6} {weight:>6}  {100 * weight / total if total else 0:5.1f}%")
+        print(f"key {polyglotKey(board):016x}, {len(entries)} moves, probe took {elapsed * 1e6:.0f}us")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
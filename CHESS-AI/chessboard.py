@@ -1,116 +1,427 @@
-import struct
-import numpy as np
+from array import array
 import json
+import os
+import random
+import struct
+import sys
+import zlib
+import evaluation
+
+# the precomputed move tables, and the binary cache of the tables built from the magics (see Board.initTables)
+PRELOADEDDATAPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "preloadedData.json")
+TABLECACHEPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "preloadedData.bin")
+
+# The cache file starts with a header of a tag, the version of the layout, a checksum of the magics and whether the
+# tables were written little endian, followed by the tables as unsigned 64 bit integers.
+# Bump TABLECACHEVERSION when the layout or the way the tables are built changes.
+TABLECACHEHEADER = struct.Struct("<4sIIB")
+TABLECACHETAG = b"SCEM"
+TABLECACHEVERSION = 1
+
+# Piece codes. A piece is its color OR'd with its type, so piece & BLACK is its color and piece & 7 its type.
+# EMPTY marks an empty square of the mailbox.
+EMPTY = 0
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 1, 2, 3, 4, 5, 6
+WHITE, BLACK = 0, 8
+WHITEPAWN, WHITEKNIGHT, WHITEBISHOP, WHITEROOK, WHITEQUEEN, WHITEKING = 1, 2, 3, 4, 5, 6
+BLACKPAWN, BLACKKNIGHT, BLACKBISHOP, BLACKROOK, BLACKQUEEN, BLACKKING = 9, 10, 11, 12, 13, 14
+# Board.pieceBbs holds the bitboard of each piece at its code, the pieces of each color at the color and the squares
+# each color attacks at color | ATTACKS
+ATTACKS = 7
+WHITEATTACKS, BLACKATTACKS = 7, 15
+
+# the FEN character of each piece code, "." for empty squares and unused codes
+PIECECHARS = ".PNBRQK..pnbrqk."
+PIECECODES = {char: code for code, char in enumerate(PIECECHARS) if char != "."}
+# the number of empty squares each digit of a FEN stands for
+EMPTYRUNS = {str(count): count for count in range(1, 9)}
+# names of the bitboards in the Board.bitboards view, with their index in Board.pieceBbs
+BITBOARDNAMES = dict(PIECECODES, white=WHITE, black=BLACK, whiteatk=WHITEATTACKS, blackatk=BLACKATTACKS)
+
+# Moves are 16 bit integers:
+#   start square (6 bits) | end square << 6 (6 bits) | promotion << 12 (2 bits) | flag << 14 (2 bits)
+# The promotion field is an index into PROMOTIONTYPES and is only used when the flag is PROMOTIONFLAG, so a move
+# without one promotes to a queen. 0 (a1 to a1) is never a move and is used for "no move".
+NORMALFLAG, PROMOTIONFLAG, ENPASSANTFLAG, CASTLINGFLAG = 0, 1, 2, 3
+PROMOTIONTYPES = (QUEEN, ROOK, BISHOP, KNIGHT)
+# the squares a pawn promotes on, the first and the eighth rank
+PROMOTIONRANKS = 18374686479671623935
+
+# Castling rights, the bits of Board.castlingRights, in the order of the castling field of a FEN
+WHITEKINGSIDE, WHITEQUEENSIDE, BLACKKINGSIDE, BLACKQUEENSIDE = 1, 2, 4, 8
+CASTLINGCHARS = "KQkq"
+# the castling rights that are kept when a piece moves from or to each square: a king leaving its square loses both
+# rights of its color and a rook leaving or captured on its square loses the right of that rook
+CASTLINGMASKS = tuple(15 ^ {0: WHITEQUEENSIDE, 4: WHITEKINGSIDE | WHITEQUEENSIDE, 7: WHITEKINGSIDE, 56: BLACKQUEENSIDE,
+                            60: BLACKKINGSIDE | BLACKQUEENSIDE, 63: BLACKKINGSIDE}.get(index, 0) for index in range(64))
+# the castling moves of each color as (right, king start, king end, rook start, rook end, squares that must be empty,
+# squares the king passes through or lands on, which must not be attacked)
+CASTLINGMOVES = {
+    WHITE: ((WHITEKINGSIDE, 4, 6, 7, 5, 0x60, 0x60), (WHITEQUEENSIDE, 4, 2, 0, 3, 0xe, 0xc)),
+    BLACK: ((BLACKKINGSIDE, 60, 62, 63, 61, 0x60 << 56, 0x60 << 56), (BLACKQUEENSIDE, 60, 58, 56, 59, 0xe << 56, 0xc << 56)),
+}
+# (rook start, rook end) of the castling move that takes the king to each square
+CASTLINGROOKS = {kingEnd: (rookStart, rookEnd) for castlings in CASTLINGMOVES.values()
+                 for right, kingStart, kingEnd, rookStart, rookEnd, emptyBb, safeBb in castlings}
+
+# the status of the side to move, as returned by Board.check() and Board.gameStatus()
+CHECKMATE, CHECK, STALEMATE, INPLAY = -1, -2, 0, 1
+
+# the legal move cache of a Board is emptied when it holds this many positions
+LEGALMOVECACHESIZE = 4096
+
+# the name of each square, e.g. SQUARENAMES[12] == "e2"
+SQUARENAMES = tuple(file + rank for rank in "12345678" for file in "abcdefgh")
+
+
+# packs a move, promotion is the piece type a pawn promotes to
+def encodeMove(start, end, flag=NORMALFLAG, promotion=QUEEN):
+    return start | end << 6 | PROMOTIONTYPES.index(promotion) << 12 | flag << 14
+
+
+def moveStart(move):
+    return move & 63
+
+
+def moveEnd(move):
+    return move >> 6 & 63
+
+
+def moveFlag(move):
+    return move >> 14
+
+
+# returns the piece type a promotion promotes to, EMPTY if the move is not a promotion
+def movePromotion(move):
+    if move >> 14 != PROMOTIONFLAG:
+        return EMPTY
+    return PROMOTIONTYPES[move >> 12 & 3]
+
+
+# returns the move in UCI (long algebraic) notation, e.g. "e2e4" or "e7e8q"
+def move2Uci(move):
+    uci = SQUARENAMES[move & 63] + SQUARENAMES[move >> 6 & 63]
+    if move >> 14 == PROMOTIONFLAG:
+        uci += "qrbn"[move >> 12 & 3]
+    return uci
+
 
 class Board:
 
-    # Board initializes with instance variables fen, board and bitboard. There is also a fileRank
-    # which is used to help get the file rank mapping of a piece square given index of board.
-    # Each board is represented in three ways: board, fen, and bitboards.
-    # (Board) A list of length 64 which contains information for the pieces on each
-    # square of the board. Uppercase letters denote WHITE, lowercase denotes BLACK and "." denotes nothing.
+    # Each board is represented in three ways: a mailbox, a fen, and bitboards.
+    # (Mailbox) A bytearray of length 64 which holds the piece code (see PIECECHARS) on each square, EMPTY for
+    # nothing. The board property gives the same as a list of characters: uppercase letters denote WHITE,
+    # lowercase denotes BLACK and "." denotes nothing.
     # (FEN) A fen string.
     # (Bitboards) Bitboards are used to represent sets of pieces. These sets can represents a number of different
     # types of squares (pieces, attacked squares, possible moves, pieces blocking sliding pieces, etc) and can be
-    # manipulated efficiently using bit operations such as AND/OR. Piece bitboards are represented in a dictionary
-    # called bitboards that takes characters from the board representation as keys. Bitboards are 64 bit integers
-    # where the least significant position (first bit) corresponds with a1 and the most significant position (64th bit)
-    # corresponds with h8.
+    # manipulated efficiently using bit operations such as AND/OR. They are kept in a list of 16 called pieceBbs,
+    # indexed by piece code, color (the pieces of that color) or color | ATTACKS (the squares that color attacks).
+    # The bitboards property gives the same as a dictionary keyed by piece characters and "white", "black",
+    # "whiteatk" and "blackatk". Bitboards are 64 bit integers where the least significant position (first bit)
+    # corresponds with a1 and the most significant position (64th bit) corresponds with h8.
+    # There is also a fileRank which is used to help get the file rank mapping of a piece square given index of board.
+
+    # boards are small and many of them may be alive at once, so they have no __dict__
+    __slots__ = ("mailbox", "pieceBbs", "fen", "whiteEnpassant", "blackEnpassant", "whiteToMove", "castlingRights",
+                 "halfmoveClock", "fullmoveNumber", "moveStack", "squareAttacks", "zobristKey", "evalScore",
+                 "legalMoveCache")
+
+    rookMagics = (
+        0xa8002c000108020, 0x6c00049b0002001, 0x100200010090040, 0x2480041000800801, 0x280028004000800,
+    0x900410008040022, 0x280020001001080, 0x2880002041000080, 0xa000800080400034, 0x4808020004000,
+    0x2290802004801000, 0x411000d00100020, 0x402800800040080, 0xb000401004208, 0x2409000100040200,
+    0x1002100004082, 0x22878001e24000, 0x1090810021004010, 0x801030040200012, 0x500808008001000,
+    0xa08018014000880, 0x8000808004000200, 0x201008080010200, 0x801020000441091, 0x800080204005,
+    0x1040200040100048, 0x120200402082, 0xd14880480100080, 0x12040280080080, 0x100040080020080,
+    0x9020010080800200, 0x813241200148449, 0x491604001800080, 0x100401000402001, 0x4820010021001040,
+    0x400402202000812, 0x209009005000802, 0x810800601800400, 0x4301083214000150, 0x204026458e001401,
+    0x40204000808000, 0x8001008040010020, 0x8410820820420010, 0x1003001000090020, 0x804040008008080,
+    0x12000810020004, 0x1000100200040208, 0x430000a044020001, 0x280009023410300, 0xe0100040002240,
+    0x200100401700, 0x2244100408008080, 0x8000400801980, 0x2000810040200, 0x8010100228810400,
+    0x2000009044210200, 0x4080008040102101, 0x40002080411d01, 0x2005524060000901, 0x502001008400422,
+    0x489a000810200402, 0x1004400080a13, 0x4000011008020084, 0x26002114058042)
+
+    bishopMagics = (
+        0x89a1121896040240, 0x2004844802002010, 0x2068080051921000, 0x62880a0220200808, 0x4042004000000,
+    0x100822020200011, 0xc00444222012000a, 0x28808801216001, 0x400492088408100, 0x201c401040c0084,
+    0x840800910a0010, 0x82080240060, 0x2000840504006000, 0x30010c4108405004, 0x1008005410080802,
+    0x8144042209100900, 0x208081020014400, 0x4800201208ca00, 0xf18140408012008, 0x1004002802102001,
+    0x841000820080811, 0x40200200a42008, 0x800054042000, 0x88010400410c9000, 0x520040470104290,
+    0x1004040051500081, 0x2002081833080021, 0x400c00c010142, 0x941408200c002000, 0x658810000806011,
+    0x188071040440a00, 0x4800404002011c00, 0x104442040404200, 0x511080202091021, 0x4022401120400,
+    0x80c0040400080120, 0x8040010040820802, 0x480810700020090, 0x102008e00040242, 0x809005202050100,
+    0x8002024220104080, 0x431008804142000, 0x19001802081400, 0x200014208040080, 0x3308082008200100,
+    0x41010500040c020, 0x4012020c04210308, 0x208220a202004080, 0x111040120082000, 0x6803040141280a00,
+    0x2101004202410000, 0x8200000041108022, 0x21082088000, 0x2410204010040, 0x40100400809000,
+    0x822088220820214, 0x40808090012004, 0x910224040218c9, 0x402814422015008, 0x90014004842410,
+    0x1000042304105, 0x10008830412a00, 0x2520081090008908, 0x40102000a0a60140)
+
+    # Magic bitboard tables for the sliding pieces. They are shared by every Board and are filled in once by
+    # initMagicTables() from the magics above. For each square, the Masks hold the relevant occupancy (the rays of
+    # the piece without the edge squares), the Shifts are 64 minus the number of bits in that mask, and the Tables
+    # hold the attack bitboard for every blocker configuration, indexed by ((occupancy & mask) * magic) >> shift.
+    rookMasks = None
+    bishopMasks = None
+    rookShifts = None
+    bishopShifts = None
+    rookTable = None
+    bishopTable = None
+    # squares attacked by a white/black pawn on each square, also filled in by initMagicTables()
+    whitePawnAttacks = None
+    blackPawnAttacks = None
+    # betweenMasks[a][b] holds the squares strictly between a and b if they are on the same rank, file or diagonal
+    # and 0 otherwise, also filled in by initMagicTables()
+    betweenMasks = None
+
+    # Zobrist keys, filled in once by initZobristKeys(). The key of a position is the XOR of the key of each piece on
+    # its square, zobristBlackToMove when it is black's turn, the key of the file of the en passant square if any and
+    # the key of the castling rights. zobristPieces is indexed by piece code and then by square, zobristCastling by
+    # castlingRights (0 for no rights).
+    zobristPieces = None
+    zobristBlackToMove = None
+    zobristEnpassant = None
+    zobristCastling = None
+
+    # material plus piece-square value of each piece on each square, positive for white and negative for black
+    # (see evaluation.pieceSquareValues), indexed by piece code and then by square
+    pieceSquareValues = None
+
+    # when True, push() checks the incrementally updated attack maps, zobrist key and evalScore against a full recompute
+    verifyAttacks = False
+
+    # Tables shared by every Board, filled in once per process by initTables(). fileRank maps a board index to its
+    # (file, rank), fileRank2index maps a square name such as "e4" to its index and startMailbox is the mailbox of the
+    # starting position. The Moves tables hold the moves of each piece on each square of an empty board.
+    fileRank = None
+    fileRank2index = None
+    startMailbox = None
+    knightMoves = None
+    kingMoves = None
+    bishopMoves = None
+    bishopForeslash = None
+    bishopBackslash = None
+    rookMoves = None
+    queenMoves = None
+
+    fileMasks = (
+        72340172838076673,
+        144680345676153346,
+        289360691352306692,
+        578721382704613384,
+        1157442765409226768,
+        2314885530818453536,
+        4629771061636907072,
+        9259542123273814144
+    )
+
+    rankMasks = (
+        255,
+        65280,
+        16711680,
+        4278190080,
+        1095216660480,
+        280375465082880,
+        71776119061217280,
+        18374686479671623680,
+    )
 
     def __init__(self):
-        with open("./preloadedData.json", "r") as readFile:
-            preloadedData = json.load(readFile)
-        self.fileRank = preloadedData["fileRank"]
-        self.fileRank2index = preloadedData["fileRank2index"]
-        self.board = preloadedData["board"]
-        self.bitboards = preloadedData["bitboards"]
-        self.knightMoves = preloadedData["knightMoves"]
-        self.kingMoves = preloadedData["kingMoves"]
-        self.bishopMoves = preloadedData["bishopMoves"]
-        self.bishopForeslash = preloadedData["bishopForeslash"]
-        self.bishopBackslash = preloadedData["bishopBackslash"]
-        self.rookMoves = preloadedData["rookMoves"]
-        self.queenMoves = preloadedData["queenMoves"]
-        self.precalcBishopMoves = preloadedData["precalcBishopMoves"]
-        self.precalcRookMoves = preloadedData["precalcRookMoves"]
+        if Board.knightMoves is None:
+            self.initTables()
+        self.mailbox = bytearray(self.startMailbox)
+        self.pieceBbs = [0] * 16
 
         self.fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
 
-        self.rookMagics = (
-            0xa8002c000108020, 0x6c00049b0002001, 0x100200010090040, 0x2480041000800801, 0x280028004000800,
-        0x900410008040022, 0x280020001001080, 0x2880002041000080, 0xa000800080400034, 0x4808020004000,
-        0x2290802004801000, 0x411000d00100020, 0x402800800040080, 0xb000401004208, 0x2409000100040200,
-        0x1002100004082, 0x22878001e24000, 0x1090810021004010, 0x801030040200012, 0x500808008001000,
-        0xa08018014000880, 0x8000808004000200, 0x201008080010200, 0x801020000441091, 0x800080204005,
-        0x1040200040100048, 0x120200402082, 0xd14880480100080, 0x12040280080080, 0x100040080020080,
-        0x9020010080800200, 0x813241200148449, 0x491604001800080, 0x100401000402001, 0x4820010021001040,
-        0x400402202000812, 0x209009005000802, 0x810800601800400, 0x4301083214000150, 0x204026458e001401,
-        0x40204000808000, 0x8001008040010020, 0x8410820820420010, 0x1003001000090020, 0x804040008008080,
-        0x12000810020004, 0x1000100200040208, 0x430000a044020001, 0x280009023410300, 0xe0100040002240,
-        0x200100401700, 0x2244100408008080, 0x8000400801980, 0x2000810040200, 0x8010100228810400,
-        0x2000009044210200, 0x4080008040102101, 0x40002080411d01, 0x2005524060000901, 0x502001008400422,
-        0x489a000810200402, 0x1004400080a13, 0x4000011008020084, 0x26002114058042)
-
-        self.bishopMagics = (
-            0x89a1121896040240, 0x2004844802002010, 0x2068080051921000, 0x62880a0220200808, 0x4042004000000,
-        0x100822020200011, 0xc00444222012000a, 0x28808801216001, 0x400492088408100, 0x201c401040c0084,
-        0x840800910a0010, 0x82080240060, 0x2000840504006000, 0x30010c4108405004, 0x1008005410080802,
-        0x8144042209100900, 0x208081020014400, 0x4800201208ca00, 0xf18140408012008, 0x1004002802102001,
-        0x841000820080811, 0x40200200a42008, 0x800054042000, 0x88010400410c9000, 0x520040470104290,
-        0x1004040051500081, 0x2002081833080021, 0x400c00c010142, 0x941408200c002000, 0x658810000806011,
-        0x188071040440a00, 0x4800404002011c00, 0x104442040404200, 0x511080202091021, 0x4022401120400,
-        0x80c0040400080120, 0x8040010040820802, 0x480810700020090, 0x102008e00040242, 0x809005202050100,
-        0x8002024220104080, 0x431008804142000, 0x19001802081400, 0x200014208040080, 0x3308082008200100,
-        0x41010500040c020, 0x4012020c04210308, 0x208220a202004080, 0x111040120082000, 0x6803040141280a00,
-        0x2101004202410000, 0x8200000041108022, 0x21082088000, 0x2410204010040, 0x40100400809000,
-        0x822088220820214, 0x40808090012004, 0x910224040218c9, 0x402814422015008, 0x90014004842410,
-        0x1000042304105, 0x10008830412a00, 0x2520081090008908, 0x40102000a0a60140)
-
-        self.fileMasks = {
-            0: 72340172838076673,
-            1: 144680345676153346,
-            2: 289360691352306692,
-            3: 578721382704613384,
-            4: 1157442765409226768,
-            5: 2314885530818453536,
-            6: 4629771061636907072,
-            7: 9259542123273814144
-        }
-
-        self.rankMasks = {
-            0: 255,
-            1: 65280,
-            2: 16711680,
-            3: 4278190080,
-            4: 1095216660480,
-            5: 280375465082880,
-            6: 71776119061217280,
-            7: 18374686479671623680,
-        }
-
         self.blackEnpassant = 0
         self.whiteEnpassant = 0
+        self.whiteToMove = True
+        # castling rights (see WHITEKINGSIDE etc.), the number of moves since the last capture or pawn move and the
+        # number of the move, which starts at 1 and goes up after each black move
+        self.castlingRights = WHITEKINGSIDE | WHITEQUEENSIDE | BLACKKINGSIDE | BLACKQUEENSIDE
+        self.halfmoveClock = 0
+        self.fullmoveNumber = 1
+        # undo records of the moves made with push(), see push() for the layout
+        self.moveStack = []
+        # attack bitboard of the piece on each square (0 for empty squares). Unlike pseudovalidMoves these include
+        # squares occupied by friendly pieces. whiteatk and blackatk are the unions of these for each color.
+        self.squareAttacks = [0] * 64
+        # zobrist key of the position, updated by push() and pop()
+        self.zobristKey = 0
+        # sum of pieceSquareValues of the pieces on the board (the material and piece-square score from white's point
+        # of view), updated by push() and pop()
+        self.evalScore = 0
+        # {zobrist key: (legal moves, status)} of positions the side to move's legal moves were asked for through
+        # cachedLegalMoves() or gameStatus(). It is emptied by makeMove() and fen2Board().
+        self.legalMoveCache = {}
+
+    # Fills in the class level tables. The move tables are read from preloadedData.json. The magic, pawn attack and
+    # between tables take a while to build, so they are written to a binary cache file next to this module the first
+    # time and read back from it by later processes.
+    def initTables(self):
+        with open(PRELOADEDDATAPATH, "r") as readFile:
+            preloadedData = json.load(readFile)
+        Board.fileRank = tuple(tuple(fileRank) for fileRank in preloadedData["fileRank"])
+        Board.fileRank2index = preloadedData["fileRank2index"]
+        Board.startMailbox = bytes(PIECECODES.get(piece, EMPTY) for piece in preloadedData["board"])
+        for name in ("knightMoves", "kingMoves", "bishopMoves", "bishopForeslash", "bishopBackslash", "rookMoves", "queenMoves"):
+            setattr(Board, name, tuple(preloadedData[name]))
+
+        if not self.loadTableCache():
+            self.initMagicTables()
+            self.saveTableCache()
+        self.initZobristKeys()
+        values = evaluation.pieceSquareValues()
+        Board.pieceSquareValues = tuple(values.get(piece) for piece in PIECECHARS)
+
+    # the header a cache file written from the current magics on this machine starts with
+    def tableCacheHeader(self):
+        checksum = zlib.crc32(repr((self.rookMagics, self.bishopMagics)).encode())
+        return TABLECACHEHEADER.pack(TABLECACHETAG, TABLECACHEVERSION, checksum, sys.byteorder == "little")
+
+    # Fills in the tables of initMagicTables() from the cache file. Returns False, leaving the tables as they were, if
+    # there is no cache file or it was written by another version or from other magics.
+    # The file is read in one go and the tables are copied into tuples, since tuple indexing is the fastest in the move
+    # generator: the cache only saves building the tables (about 0.3s), each process still holds its own copy.
+    # The tables are stored in this order: rookMasks, bishopMasks, whitePawnAttacks, blackPawnAttacks, the 64 rows of
+    # betweenMasks, then the attack table of each square for the rooks and then for the bishops. The size of each
+    # attack table follows from the number of bits in the mask of its square.
+    def loadTableCache(self):
+        header = self.tableCacheHeader()
+        values = array('Q')
+        try:
+            with open(TABLECACHEPATH, "rb") as cacheFile:
+                data = cacheFile.read()
+            if data[:len(header)] != header:
+                return False
+            values.frombytes(data[len(header):])
+        except (OSError, ValueError):
+            return False
 
-    # function that takes self.board from the Board object and populates self.bitboards
+        rookMasks, bishopMasks = tuple(values[0:64]), tuple(values[64:128])
+        position = 256 + 64 * 64
+        tables = []
+        for masks in (rookMasks, bishopMasks):
+            attackTables = []
+            for mask in masks:
+                size = 0b1 << mask.bit_count()
+                attackTables.append(tuple(values[position:position + size]))
+                position += size
+            tables.append(tuple(attackTables))
+        if position != len(values):
+            return False
 
+        Board.rookMasks, Board.bishopMasks = rookMasks, bishopMasks
+        Board.rookShifts = tuple(64 - mask.bit_count() for mask in rookMasks)
+        Board.bishopShifts = tuple(64 - mask.bit_count() for mask in bishopMasks)
+        Board.rookTable, Board.bishopTable = tables
+        Board.whitePawnAttacks, Board.blackPawnAttacks = tuple(values[128:192]), tuple(values[192:256])
+        Board.betweenMasks = tuple(tuple(values[256 + a * 64:256 + a * 64 + 64]) for a in range(64))
+        return True
+
+    # Writes the tables of initMagicTables() to the cache file, see loadTableCache() for the layout.
+    # The file is written under a temporary name and then renamed, so processes starting at the same time never read
+    # a partly written cache. Nothing is written if the directory is read-only; the tables are just built each time.
+    def saveTableCache(self):
+        values = array('Q', self.rookMasks + self.bishopMasks + self.whitePawnAttacks + self.blackPawnAttacks)
+        for row in self.betweenMasks:
+            values.extend(row)
+        for attackTable in self.rookTable + self.bishopTable:
+            values.extend(attackTable)
+        temporaryPath = f"{TABLECACHEPATH}.{os.getpid()}.tmp"
+        try:
+            with open(temporaryPath, "wb") as cacheFile:
+                cacheFile.write(self.tableCacheHeader())
+                values.tofile(cacheFile)
+            os.replace(temporaryPath, TABLECACHEPATH)
+        except OSError:
+            if os.path.exists(temporaryPath):
+                os.remove(temporaryPath)
+
+    # function that takes self.mailbox from the Board object and populates self.pieceBbs
     def board2Bitboard(self):
-
-        for key in self.bitboards.keys():
-            self.bitboards[key] = 0b0
-        # iterates over board
-        for pieceIndex in range(63, -1, -1):
-            # iterates of the keys of bitboards dictionary, if the piece == key, then a 1 bit is appended to the piece bitboard
-            # otherwise the piece bitboard is shifted 1 to the left (append a 0 bit)
-            for key in self.bitboards.keys():
-                self.bitboards[key] <<= 1
-                if self.board[pieceIndex] == key:
-                    self.bitboards[key] |= 0b1
-        self.bitboards["white"] = self.bitboards['B'] | self.bitboards['N'] | self.bitboards[
-            'R'] | self.bitboards['Q'] | self.bitboards['P'] | self.bitboards['K']
-        self.bitboards["black"] = self.bitboards['b'] | self.bitboards['n'] | self.bitboards[
-            'r'] | self.bitboards['q'] | self.bitboards['p'] | self.bitboards['k']
-        self.bitboards["whiteatk"] = self.attackedSquares("white")
-        self.bitboards["blackatk"] = self.attackedSquares("black")
+        pieceBbs = self.pieceBbs
+        for i in range(16):
+            pieceBbs[i] = 0b0
+        for index, piece in enumerate(self.mailbox):
+            if piece != EMPTY:
+                pieceBbs[piece] |= 0b1 << index
+                pieceBbs[piece & BLACK] |= 0b1 << index
+        self.refreshAttacks()
+        self.zobristKey = self.computeZobristKey()
+        self.evalScore = self.computeEvalScore()
+
+    # The pieces on each square as characters, uppercase for white, lowercase for black and "." for empty squares.
+    # This is a copy for code that reads the board by character (the GUI and the console game); changing it does not
+    # change the Board.
+    @property
+    def board(self):
+        return [PIECECHARS[piece] for piece in self.mailbox]
+
+    # The bitboards as a dictionary keyed by piece character, "white", "black", "whiteatk" and "blackatk".
+    # Like board, this is a copy.
+    @property
+    def bitboards(self):
+        pieceBbs = self.pieceBbs
+        return {name: pieceBbs[index] for name, index in BITBOARDNAMES.items()}
+
+    # returns an independent Board in the same position, with the same moves to take back with pop()
+    def copy(self):
+        other = Board.__new__(Board)
+        other.mailbox = bytearray(self.mailbox)
+        other.pieceBbs = self.pieceBbs[:]
+        other.fen = self.fen
+        other.whiteEnpassant = self.whiteEnpassant
+        other.blackEnpassant = self.blackEnpassant
+        other.whiteToMove = self.whiteToMove
+        other.castlingRights = self.castlingRights
+        other.halfmoveClock = self.halfmoveClock
+        other.fullmoveNumber = self.fullmoveNumber
+        other.moveStack = self.moveStack[:]
+        other.squareAttacks = self.squareAttacks[:]
+        other.zobristKey = self.zobristKey
+        other.evalScore = self.evalScore
+        other.legalMoveCache = {}
+        return other
+
+    # fills the class level zobrist keys. A fixed seed keeps keys (and anything stored with them) the same between runs
+    def initZobristKeys(self):
+        generator = random.Random(20230101)
+        keys = {piece: tuple(generator.getrandbits(64) for index in range(64)) for piece in "PNBRQKpnbrqk"}
+        Board.zobristPieces = tuple(keys.get(piece) for piece in PIECECHARS)
+        Board.zobristBlackToMove = generator.getrandbits(64)
+        Board.zobristEnpassant = tuple(generator.getrandbits(64) for file in range(8))
+        rightKeys = tuple(generator.getrandbits(64) for right in CASTLINGCHARS)
+        castlingKeys = []
+        for rights in range(16):
+            key = 0
+            for bit, rightKey in enumerate(rightKeys):
+                if rights >> bit & 1:
+                    key ^= rightKey
+            castlingKeys.append(key)
+        Board.zobristCastling = tuple(castlingKeys)
+
+    # computes the zobrist key of the position from scratch
+    def computeZobristKey(self):
+        key = 0
+        for index, piece in enumerate(self.mailbox):
+            if piece != EMPTY:
+                key ^= self.zobristPieces[piece][index]
+        if not self.whiteToMove:
+            key ^= self.zobristBlackToMove
+        enpassant = self.whiteEnpassant | self.blackEnpassant
+        if enpassant:
+            key ^= self.zobristEnpassant[self.bitboard2Index(enpassant) % 8]
+        return key ^ self.zobristCastling[self.castlingRights]
+
+    # computes evalScore from scratch
+    def computeEvalScore(self):
+        score = 0
+        for index, piece in enumerate(self.mailbox):
+            if piece != EMPTY:
+                score += self.pieceSquareValues[piece][index]
+        return score
 
     def pawnMoves(self, index):
         # given index of a pawn check in front to see if it is blocked by a piece
@@ -123,13 +434,13 @@ class Board:
         uint64 = 18446744073709551615
         # create bitboards of the pawn and bitboard off all pieces on the board
         pawnBb = 0b1 << index
-        pieceMask = self.bitboards["white"] | self.bitboards["black"]
+        pieceMask = self.pieceBbs[WHITE] | self.pieceBbs[BLACK]
         # first if block determines the color of the piece
-        if self.board[index] == "P":
+        if self.mailbox[index] == WHITEPAWN:
             # pawnForwardMask is mask of piece in front of a pawn. If the pawn is in the starting rank,
             # then it also contains another set bit two spaces in front of the pawn
             pawnForwardMask = pawnBb << 8
-            enemyMask = self.bitboards["black"]
+            enemyMask = self.pieceBbs[BLACK]
             # there are three cases for pawn attacks. If it is in the a file, then we will not check the square to front left for enemy
             # if in the h file, then we will not check the square to the front right
             # otherwise, we check both front left and right for an enemy piece
@@ -143,9 +454,9 @@ class Board:
             elif index % 8 == 7:
                 return (((pawnForwardMask & pieceMask) ^ (pawnForwardMask | (pawnBb << 7 & enemyMask))) | (pawnBb << 7 & self.blackEnpassant)) & uint64
             return (((pawnForwardMask & pieceMask) ^ (pawnForwardMask | (pawnBb << 7 & enemyMask | pawnBb << 9 & enemyMask))) | ((pawnBb << 7 | pawnBb << 9) & self.blackEnpassant)) & uint64
-        elif self.board[index] == 'p':
+        elif self.mailbox[index] == BLACKPAWN:
             pawnForwardMask = pawnBb >> 8
-            enemyMask = self.bitboards["white"]
+            enemyMask = self.pieceBbs[WHITE]
             if self.fileRank[index][1] == 7 and 0b1 << (index - 8) & pieceMask == 0:
                 pawnForwardMask |= pawnBb >> 16
             if index % 8 == 0:
@@ -273,70 +584,116 @@ class Board:
             atk_file += 1
         return bishopBb
 
-# Bishop and Rook attacks are calculated by using the propagation of carry bits in bitwise subtraction to find a blocker.
-# (in little endian convention)
-#   01000011 occupied pieces
-# - 01000000 sliding piece
-#   00000011 blocker pieces
-# The sliding piece is cleard from the occupancy board to set up for carry bit propagation.
-#
-#   00000011 blocker pieces
-# - 01000000 sliding piece
-#   01111101 the carry bit is propagated until the bit before the blocker
+# Bishop and Rook attacks are looked up in magic bitboard tables.
+# Only the squares on the rays of a slider that are not on the edge of the board can block it (a piece on the
+# edge has nothing behind it to hide), so the occupancy is first masked down to these relevant squares.
+# Multiplying that masked occupancy by the magic number of the square gathers the relevant bits into the
+# top bits of the product, and shifting them down gives a dense index into the table of the square:
 #
-#     01000011 occupied pieces
-# xor 01111101 (blocker - sliding) piece
-#     00111110 gets the possible moves of the slider in the positive horizontal direction (including capture)
+#   attacks = table[square][((occupancy & mask[square]) * magic[square]) >> (64 - bits in mask[square])]
 #
-# This method only works in the positive direction and can only detect the first blocker in its propagation.
-# To get the negative direction moves, the bitboards involved have their endianess reversed with bitSwap() and the same calculations are made
-# To get multiple blockers in each propagation, the method is ran multiple times with different piece masks
-#   https://www.chessprogramming.org/Efficient_Generation_of_Sliding_Piece_Attacks#Sliding_Attacks_by_Calculation
-#   https://www.chessprogramming.org/Subtracting_a_Rook_from_a_Blocking_Piece
+# The tables are filled once by walking the rays for every subset of the relevant occupancy (initMagicTables).
+#   https://www.chessprogramming.org/Magic_Bitboards
+
+    # walks each of the given (rank, file) directions from index until the edge of the board or the first
+    # piece in occupancyBb. The square of the blocker is included. Only used to fill the magic tables.
+    def slidingAttackGen(self, index, occupancyBb, directions):
+        attackBb = 0b0
+        rank = index // 8
+        file = index % 8
+        for rankStep, fileStep in directions:
+            atk_rank = rank + rankStep
+            atk_file = file + fileStep
+            while 0 <= atk_rank < 8 and 0 <= atk_file < 8:
+                attackBb |= 0b1 << (atk_rank*8 + atk_file)
+                if occupancyBb >> (atk_rank*8 + atk_file) & 0b1:
+                    break
+                atk_rank += rankStep
+                atk_file += fileStep
+        return attackBb
+
+    # generates the relevant occupancy mask of a slider: its rays without the last square before the edge
+    def relevantOccupancyGen(self, index, directions):
+        maskBb = 0b0
+        rank = index // 8
+        file = index % 8
+        for rankStep, fileStep in directions:
+            atk_rank = rank + rankStep
+            atk_file = file + fileStep
+            while 0 <= atk_rank + rankStep < 8 and 0 <= atk_file + fileStep < 8:
+                maskBb |= 0b1 << (atk_rank*8 + atk_file)
+                atk_rank += rankStep
+                atk_file += fileStep
+        return maskBb
+
+    # fills the class level magic tables from rookMagics and bishopMagics, and the pawn attack tables
+    # every subset of a relevant occupancy mask is visited with the Carry-Rippler trick: subset = (subset - mask) & mask
+    def initMagicTables(self):
+        uint64 = 18446744073709551615
+        rookDirections = ((1, 0), (-1, 0), (0, 1), (0, -1))
+        bishopDirections = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+        tables = {}
+        for name, magics, directions in (("rook", self.rookMagics, rookDirections), ("bishop", self.bishopMagics, bishopDirections)):
+            masks, shifts, attackTables = [], [], []
+            for index in range(64):
+                mask = self.relevantOccupancyGen(index, directions)
+                shift = 64 - bin(mask).count("1")
+                attacks = [0] * (1 << (64 - shift))
+                subset = 0
+                while True:
+                    attacks[(subset * magics[index] & uint64) >> shift] = self.slidingAttackGen(index, subset, directions)
+                    subset = (subset - mask) & mask
+                    if subset == 0:
+                        break
+                masks.append(mask)
+                shifts.append(shift)
+                attackTables.append(tuple(attacks))
+            tables[name] = (tuple(masks), tuple(shifts), tuple(attackTables))
+        Board.rookMasks, Board.rookShifts, Board.rookTable = tables["rook"]
+        Board.bishopMasks, Board.bishopShifts, Board.bishopTable = tables["bishop"]
+
+        notAFile = 18374403900871474942
+        notHFile = 9187201950435737471
+        Board.whitePawnAttacks = tuple(((0b1 << index + 7) & notHFile | (0b1 << index + 9) & notAFile) & uint64 for index in range(64))
+        Board.blackPawnAttacks = tuple((0b1 << index >> 9) & notHFile | (0b1 << index >> 7) & notAFile for index in range(64))
+
+        # two squares on a line see each other on an empty board, and the squares between them are the squares both
+        # see when each one is the only blocker of the other
+        betweenMasks = []
+        for a in range(64):
+            row = []
+            for b in range(64):
+                between = 0
+                if a != b:
+                    if self.rookMagicAttack(a, 0) >> b & 0b1:
+                        between = self.rookMagicAttack(a, 0b1 << b) & self.rookMagicAttack(b, 0b1 << a)
+                    elif self.bishopMagicAttack(a, 0) >> b & 0b1:
+                        between = self.bishopMagicAttack(a, 0b1 << b) & self.bishopMagicAttack(b, 0b1 << a)
+                row.append(between)
+            betweenMasks.append(tuple(row))
+        Board.betweenMasks = tuple(betweenMasks)
+
+    # returns the rook attacks from index for the given occupancy, including the squares of the blockers
+    def rookMagicAttack(self, index, occupancyBb):
+        return self.rookTable[index][((occupancyBb & self.rookMasks[index]) * self.rookMagics[index] & 18446744073709551615) >> self.rookShifts[index]]
+
+    # returns the bishop attacks from index for the given occupancy, including the squares of the blockers
+    def bishopMagicAttack(self, index, occupancyBb):
+        return self.bishopTable[index][((occupancyBb & self.bishopMasks[index]) * self.bishopMagics[index] & 18446744073709551615) >> self.bishopShifts[index]]
 
     # Generates a bitboard of all possible moves of a bishop taking blockers into account
     # includes piece capture moves
     # does not check if the move leaves the king in check, making these pseudovalid moves.
 
     def bishopAttack(self, index, isBlack: bool):
+        rays = self.bishopMagicAttack(index, self.pieceBbs[WHITE] | self.pieceBbs[BLACK])
 
-        # foreslash (northeast and southwest)
-        # bitboard of northeast and southwest rays
-        atk_mask = self.bishopForeslash[index]
-        pieceBb = 0b1 << index                      # position bitboard of current piece
-        # bitboard of all the pieces on the board, (including the current one)
-        occupancyBb = self.bitboards['white'] | self.bitboards['black']
-        # bitboard to calculate northeast moves
-        positiveRayBb = occupancyBb & atk_mask
-        # Anding with the attack mask implicitly does the first subraction to clear the piece from the occupancy
-        # Reversed bitboard to calculate southwest moves
-        negativeRayBb = self.bitSwap(positiveRayBb)
-        # Subtraction to propagate carry bit
-        positiveRayBb = (positiveRayBb - pieceBb)
-        negativeRayBb = negativeRayBb - self.bitSwap(pieceBb)
-        # No need to xor with occupancy bitboard since the parts of each RayBb that were not affected by propagation are the same as occupancy.
-        foreslashRays = positiveRayBb ^ self.bitSwap(negativeRayBb)
-        foreslashRays = foreslashRays & atk_mask
-
-        # backslash (northwest and southeast)
-        atk_mask = self.bishopBackslash[index]
-        pieceBb = 0b1 << index
-        occupancyBb = self.bitboards['white'] | self.bitboards['black']
-        positiveRayBb = occupancyBb & atk_mask
-        negativeRayBb = self.bitSwap(positiveRayBb)
-        positiveRayBb = (positiveRayBb - pieceBb)
-        negativeRayBb = negativeRayBb - self.bitSwap(pieceBb)
-        backslashRays = positiveRayBb ^ self.bitSwap(negativeRayBb)
-        backslashRays = backslashRays & atk_mask
-
-        color = 'white'
+        color = WHITE
         if isBlack:
-            color = 'black'
-
-        rays = foreslashRays | backslashRays
+            color = BLACK
 
         # to remove moves that capture ally blockers
-        atkBb = (rays ^ self.bitboards[color]) & rays
+        atkBb = (rays ^ self.pieceBbs[color]) & rays
         return atkBb
 
     # generates a bitboard of all possible moves a rook could make at a given index
@@ -369,46 +726,14 @@ class Board:
     # includes piece capture moves
     # does not check if the move leaves the king in check, making these pseudovalid moves.
     def rookAttack(self, index, isBlack: bool):
-        file = index % 8
-        # Vertical Rays
-        atk_mask = self.fileMasks[file]
-        pieceBb = 0b1 << index
-        occupancyBb = self.bitboards['white'] | self.bitboards['black']
-        # need to perform additional subtraction since atk_mask doesn't clear position bit of the piece
-        upRay = occupancyBb & atk_mask - pieceBb
-        downRay = self.bitSwap(upRay)
-        upRay = (upRay - pieceBb)
-        downRay = downRay - self.bitSwap(pieceBb)
-        verticalRays = upRay ^ self.bitSwap(downRay)
-        verticalRays = verticalRays & atk_mask
+        rays = self.rookMagicAttack(index, self.pieceBbs[WHITE] | self.pieceBbs[BLACK])
 
-        rank = index//8
-        # Horizontal Rays (northweast and southeast)
-        atk_mask = self.rankMasks[rank]
-        pieceBb = 0b1 << index
-        occupancyBb = self.bitboards['white'] | self.bitboards['black']
-        rightRay = occupancyBb & atk_mask - pieceBb
-        leftRay = self.bitSwap(rightRay)
-        rightRay = (rightRay - pieceBb)
-        leftRay = leftRay - self.bitSwap(pieceBb)
-        horizontalRays = rightRay ^ self.bitSwap(leftRay)
-        horizontalRays = horizontalRays & atk_mask
-
-        color = 'white'
+        color = WHITE
         if isBlack:
-            color = 'black'
+            color = BLACK
 
-        rays = verticalRays | horizontalRays
-
-        atkBb = (rays ^ self.bitboards[color]) & rays
+        atkBb = (rays ^ self.pieceBbs[color]) & rays
         return atkBb
-    
-    # def bishopMovesMagic(self, index):
-    #     magic = asdf
-
-    # def bishopBlocks(self, index):
-    #     blockers = 
-    #     return 
 
     # generates a bitboard of all possible moves a queen could make at a given index
     # bitwise or of rook and bishop moves
@@ -417,58 +742,326 @@ class Board:
         return self.rookMovesGen(index) | self.bishopMovesGen(index)
 
     # given a starting index, ending index and color of piece, this function checks to see if the move is valid
-    # if it is valid, then the move is made by making the appropriate updates to self.board and self.bitboards
+    # if it is valid, then the move is made by making the appropriate updates to self.mailbox and self.pieceBbs
+    # a pawn that reaches the last rank promotes to the given piece type (a queen by default)
     # returns True if the move is successfully executed, false otherwise
+    # the move is made with push(), so it can be taken back with pop()
 
-    def makeMove(self, start, end, lookingForward=False):
-        if lookingForward or 0b1 << end & self.legalMoves(start):
-            if 0b1 << start & self.bitboards['p']:
-                if start // 8 == 6 and end // 8 == 4:
-                    self.blackEnpassant = 0b1 << (end + 8)
-                elif 0b1 << end & self.whiteEnpassant:
-                    self.bitboards[self.board[end + 8]] = self.toggleBit(self.bitboards[self.board[end + 8]], end + 8)
-                    self.board[end + 8] = "."
-                    self.blackEnpassant = 0
-                else:
-                    self.blackEnpassant = 0
-            elif 0b1 << start & self.bitboards['P']:
-                if start // 8 == 1 and end // 8 == 3:
-                    self.whiteEnpassant = 0b1 << (end - 8)
-                elif 0b1 << end & self.blackEnpassant:
-                    self.bitboards[self.board[end - 8]] = self.toggleBit(self.bitboards[self.board[end - 8]], end - 8)
-                    self.board[end - 8] = "."
-                    self.whiteEnpassant = 0
-                else:
-                    self.whiteEnpassant = 0
-            else:
-                self.whiteEnpassant = 0
-                self.blackEnpassant = 0
-            
-            # if a piece is taken, then the bit corresponding to that index in the taken piece's bitboard is cleared
-            if self.board[end] != ".":
-                self.bitboards[self.board[end]] = self.toggleBit(
-                    self.bitboards[self.board[end]], end)
-
-            # update the bitboard of the moved piece
-            self.bitboards[self.board[start]] = self.toggleBit(
-                self.toggleBit(self.bitboards[self.board[start]], start), end)
-
-            # update the board to represent to move
-            self.board[end], self.board[start] = self.board[start], "."
-
-            # update the bitboards of white and black pieces
-            self.bitboards["white"] = self.bitboards['B'] | self.bitboards['N'] | self.bitboards[
-                'R'] | self.bitboards['Q'] | self.bitboards['P'] | self.bitboards["K"]
-            self.bitboards["black"] = self.bitboards['b'] | self.bitboards['n'] | self.bitboards[
-                'r'] | self.bitboards['q'] | self.bitboards['p'] | self.bitboards['k']
-            self.bitboards['whiteatk'] = self.attackedSquares("white")
-            self.bitboards['blackatk'] = self.attackedSquares("black")
+    def makeMove(self, start, end, lookingForward=False, promotion=QUEEN):
+        if lookingForward:
+            move = encodeMove(start, end, promotion=promotion)
+        else:
+            move = self.findMove(start, end, promotion)
+        if move is not None:
+            self.push(move)
+            self.legalMoveCache.clear()
             return True
         else:
             print("Not a valid move")
             return False
 
-   
+    # returns the legal move of the side to move from start to end, promoting to the given piece type if it is a
+    # promotion, or None if there is no such move
+    def findMove(self, start, end, promotion=QUEEN):
+        for move in self.cachedLegalMoves():
+            if move & 4095 == start | end << 6 and (move >> 14 != PROMOTIONFLAG or PROMOTIONTYPES[move >> 12 & 3] == promotion):
+                return move
+        return None
+
+    # returns the legal move of the side to move written in UCI notation (e.g. "e2e4", "e7e8q"), or None if the
+    # string is not one
+    def uci2Move(self, uci):
+        if len(uci) not in (4, 5) or uci[0:2] not in self.fileRank2index or uci[2:4] not in self.fileRank2index:
+            return None
+        promotion = QUEEN
+        if len(uci) == 5:
+            if uci[4] not in "qrbn":
+                return None
+            promotion = PROMOTIONTYPES["qrbn".index(uci[4])]
+        return self.findMove(self.fileRank2index[uci[0:2]], self.fileRank2index[uci[2:4]], promotion)
+
+    # Returns the legal move of the side to move written in standard algebraic notation (e.g. "Nf3", "exd5", "e8=Q+",
+    # "O-O"), or None if the string is not one. Check and annotation marks at the end are ignored.
+    # The piece that moves is looked up in the attack tables: the pieces of the named type that attack the target square
+    # (for pawns, that can reach it), narrowed down by the file or rank given to disambiguate. The moves of the pieces
+    # that fit are then tried with push() and pop(), so a pinned piece or a king walking into check is not taken: an
+    # illegal move in a game record gives None, as does a move that more than one piece can make.
+    def san2Move(self, san):
+        san = san.rstrip("+#!?")
+        color = WHITE if self.whiteToMove else BLACK
+        if san in ("O-O", "O-O-O", "0-0", "0-0-0"):
+            kingStart = 4 if color == WHITE else 60
+            move = kingStart | (kingStart + 2 if len(san) == 3 else kingStart - 2) << 6 | CASTLINGFLAG << 14
+            return move if move in self.cachedLegalMoves() else None
+
+        promotion = None
+        if len(san) > 2 and san[-1] in "QRBN" and san[0] in "abcdefgh":
+            promotion = PIECECODES[san[-1]]
+            san = san[:-2] if san[-2] == "=" else san[:-1]
+        if len(san) < 2 or san[-2:] not in self.fileRank2index:
+            return None
+        end = self.fileRank2index[san[-2:]]
+        if san[0] in "NBRQK":
+            pieceType = PIECECODES[san[0]]
+            disambiguation = san[1:-2]
+        else:
+            pieceType = PAWN
+            disambiguation = san[:-2]
+        startMask = 18446744073709551615
+        for char in disambiguation.replace("x", ""):
+            if "a" <= char <= "h":
+                startMask &= self.fileMasks[ord(char) - ord("a")]
+            elif "1" <= char <= "8":
+                startMask &= self.rankMasks[ord(char) - ord("1")]
+            else:
+                return None
+
+        pieceBbs = self.pieceBbs
+        mailbox = self.mailbox
+        if 0b1 << end & pieceBbs[color]:
+            return None
+        own = pieceBbs[color | pieceType] & startMask
+        flag = NORMALFLAG
+        promotionIndex = 0
+        if pieceType == PAWN:
+            enpassant = self.blackEnpassant if color == WHITE else self.whiteEnpassant
+            if disambiguation:
+                # a capture: the pawns that would attack the target square
+                candidates = (self.blackPawnAttacks if color == WHITE else self.whitePawnAttacks)[end] & own
+                if 0b1 << end & enpassant:
+                    flag = ENPASSANTFLAG
+                elif mailbox[end] == EMPTY:
+                    return None
+            else:
+                step = -8 if color == WHITE else 8
+                behind = end + step
+                candidates = 0
+                if mailbox[end] == EMPTY and 0 <= behind < 64:
+                    if mailbox[behind] == color | PAWN:
+                        candidates = 0b1 << behind
+                    elif mailbox[behind] == EMPTY and end // 8 == (3 if color == WHITE else 4):
+                        candidates = 0b1 << (behind + step) & own
+            if 0b1 << end & PROMOTIONRANKS:
+                if promotion is None:
+                    return None
+                flag = PROMOTIONFLAG
+                promotionIndex = PROMOTIONTYPES.index(promotion)
+            elif promotion is not None:
+                return None
+        elif pieceType == KNIGHT:
+            candidates = self.knightMoves[end] & own
+        elif pieceType == KING:
+            candidates = self.kingMoves[end] & own
+        else:
+            occupancyBb = pieceBbs[WHITE] | pieceBbs[BLACK]
+            candidates = 0
+            if pieceType != ROOK:
+                candidates |= self.bishopMagicAttack(end, occupancyBb) & own
+            if pieceType != BISHOP:
+                candidates |= self.rookMagicAttack(end, occupancyBb) & own
+
+        moves = []
+        while candidates:
+            moves.append((candidates & -candidates).bit_length() - 1 | end << 6 | promotionIndex << 12 | flag << 14)
+            candidates &= candidates - 1
+        legal = []
+        for move in moves:
+            self.push(move)
+            if not self.inCheck(color == BLACK):
+                legal.append(move)
+            self.pop()
+        return legal[0] if len(legal) == 1 else None
+
+    # Returns the legal move of the side to move in standard algebraic notation, with "+" or "#" when it gives check or
+    # mate. The start file, rank or square is added when another piece of the same type can also move to the target.
+    def move2San(self, move):
+        start, end, flag = move & 63, move >> 6 & 63, move >> 14
+        mailbox = self.mailbox
+        if flag == CASTLINGFLAG:
+            san = "O-O" if end > start else "O-O-O"
+        else:
+            pieceType = mailbox[start] & 7
+            capture = "x" if mailbox[end] != EMPTY or flag == ENPASSANTFLAG else ""
+            if pieceType == PAWN:
+                san = (SQUARENAMES[start][0] + capture if capture else "") + SQUARENAMES[end]
+                if flag == PROMOTIONFLAG:
+                    san += "=" + PIECECHARS[PROMOTIONTYPES[move >> 12 & 3]]
+            else:
+                others = [other & 63 for other in self.cachedLegalMoves()
+                          if other >> 6 & 63 == end and other & 63 != start and mailbox[other & 63] & 7 == pieceType]
+                if not others:
+                    disambiguation = ""
+                elif all(other % 8 != start % 8 for other in others):
+                    disambiguation = SQUARENAMES[start][0]
+                elif all(other // 8 != start // 8 for other in others):
+                    disambiguation = SQUARENAMES[start][1]
+                else:
+                    disambiguation = SQUARENAMES[start]
+                san = PIECECHARS[pieceType] + disambiguation + capture + SQUARENAMES[end]
+        self.push(move)
+        if self.inCheck(not self.whiteToMove):
+            san += "+" if self.hasAnyLegalMove() else "#"
+        self.pop()
+        return san
+
+    # makes the move without checking that it is legal and records what is needed to take it back on self.moveStack.
+    # A pawn that reaches the last rank becomes the piece of the promotion field of the move. En passant captures are
+    # recognised from the en passant squares and castling from a king moving two squares, so a move from encodeMove()
+    # without the flag works too. Castling is given as the move of the king; the rook is moved along with it.
+    # Each undo record is a tuple of
+    # (start, end, moved piece, captured piece, index of captured piece, whiteEnpassant, blackEnpassant, whiteatk, blackatk,
+    #  list of (index, previous squareAttacks[index]) for every entry of squareAttacks that the move changed, zobristKey,
+    #  evalScore, castlingRights, halfmoveClock)
+    # whiteEnpassant/blackEnpassant hold the square behind a white/black pawn that just moved two squares, so both are
+    # cleared by every other move.
+    def push(self, move):
+        start, end = move & 63, move >> 6 & 63
+        mailbox = self.mailbox
+        pieceBbs = self.pieceBbs
+        piece = mailbox[start]
+        friendly = piece & BLACK
+        enemy = friendly ^ BLACK
+        # the piece that ends up on end
+        placed = piece
+        captureIndex = end
+        castlingRook = None
+        if piece == WHITEPAWN:
+            if 0b1 << end & self.blackEnpassant:
+                captureIndex = end - 8
+            elif end >= 56:
+                placed = WHITE | PROMOTIONTYPES[move >> 12 & 3]
+        elif piece == BLACKPAWN:
+            if 0b1 << end & self.whiteEnpassant:
+                captureIndex = end + 8
+            elif end < 8:
+                placed = BLACK | PROMOTIONTYPES[move >> 12 & 3]
+        elif piece & 7 == KING and (end - start == 2 or start - end == 2):
+            castlingRook = CASTLINGROOKS[end]
+        captured = mailbox[captureIndex]
+        squareAttacks = self.squareAttacks
+        changes = [(start, squareAttacks[start]), (end, squareAttacks[end])]
+        self.moveStack.append((start, end, piece, captured, captureIndex, self.whiteEnpassant, self.blackEnpassant,
+                               pieceBbs[WHITEATTACKS], pieceBbs[BLACKATTACKS], changes, self.zobristKey, self.evalScore,
+                               self.castlingRights, self.halfmoveClock))
+
+        zobristPieces = self.zobristPieces
+        key = self.zobristKey ^ self.zobristBlackToMove ^ zobristPieces[piece][start] ^ zobristPieces[placed][end]
+        self.evalScore += self.pieceSquareValues[placed][end] - self.pieceSquareValues[piece][start]
+        enpassant = self.whiteEnpassant | self.blackEnpassant
+        if enpassant:
+            key ^= self.zobristEnpassant[((enpassant & -enpassant).bit_length() - 1) % 8]
+
+        self.whiteEnpassant = 0b1 << (end - 8) if piece == WHITEPAWN and end - start == 16 else 0
+        self.blackEnpassant = 0b1 << (end + 8) if piece == BLACKPAWN and start - end == 16 else 0
+        if self.whiteEnpassant or self.blackEnpassant:
+            key ^= self.zobristEnpassant[end % 8]
+        rights = self.castlingRights
+        if rights:
+            self.castlingRights = rights & CASTLINGMASKS[start] & CASTLINGMASKS[end]
+            key ^= self.zobristCastling[rights] ^ self.zobristCastling[self.castlingRights]
+        if captured != EMPTY or piece & 7 == PAWN:
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        if friendly == BLACK:
+            self.fullmoveNumber += 1
+
+        # if a piece is taken, then the bit corresponding to that index in the taken piece's bitboard is cleared
+        if captured != EMPTY:
+            mailbox[captureIndex] = EMPTY
+            pieceBbs[captured] ^= 0b1 << captureIndex
+            pieceBbs[enemy] ^= 0b1 << captureIndex
+            key ^= zobristPieces[captured][captureIndex]
+            self.evalScore -= self.pieceSquareValues[captured][captureIndex]
+        # castling also moves the rook
+        changedBb = 0b1 << captureIndex
+        if castlingRook is not None:
+            rookStart, rookEnd = castlingRook
+            rook = friendly | ROOK
+            changedBb |= 0b1 << rookStart | 0b1 << rookEnd
+            pieceBbs[rook] ^= 0b1 << rookStart | 0b1 << rookEnd
+            pieceBbs[friendly] ^= 0b1 << rookStart | 0b1 << rookEnd
+            mailbox[rookEnd], mailbox[rookStart] = rook, EMPTY
+            key ^= zobristPieces[rook][rookStart] ^ zobristPieces[rook][rookEnd]
+            self.evalScore += self.pieceSquareValues[rook][rookEnd] - self.pieceSquareValues[rook][rookStart]
+        self.zobristKey = key
+
+        # update the bitboards of the moved piece and of its color, then the mailbox
+        moveBb = 0b1 << start | 0b1 << end
+        pieceBbs[piece] ^= 0b1 << start
+        pieceBbs[placed] ^= 0b1 << end
+        pieceBbs[friendly] ^= moveBb
+        mailbox[end], mailbox[start] = placed, EMPTY
+        self.whiteToMove = not self.whiteToMove
+
+        # Only the attacks of the moved piece, the captured piece and the sliders whose rays reached one of the squares
+        # that changed occupancy are recomputed. A slider's rays end on the first blocker, so they pass through a changed
+        # square exactly when that square is in its attack bitboard.
+        occupancyBb = pieceBbs[WHITE] | pieceBbs[BLACK]
+        changedBb |= moveBb
+        squareAttacks[start] = 0
+        if captureIndex != end:
+            changes.append((captureIndex, squareAttacks[captureIndex]))
+            squareAttacks[captureIndex] = 0
+        squareAttacks[end] = self.pieceAttacks(end, placed, occupancyBb)
+        placedBb = 0b1 << end
+        if castlingRook is not None:
+            changes.append((rookStart, squareAttacks[rookStart]))
+            changes.append((rookEnd, squareAttacks[rookEnd]))
+            squareAttacks[rookStart] = 0
+            squareAttacks[rookEnd] = self.pieceAttacks(rookEnd, rook, occupancyBb)
+            placedBb |= 0b1 << rookEnd
+        sliders = (pieceBbs[WHITEBISHOP] | pieceBbs[WHITEROOK] | pieceBbs[WHITEQUEEN]
+                   | pieceBbs[BLACKBISHOP] | pieceBbs[BLACKROOK] | pieceBbs[BLACKQUEEN]) & ~placedBb
+        while sliders:
+            index = (sliders & -sliders).bit_length() - 1
+            if squareAttacks[index] & changedBb:
+                changes.append((index, squareAttacks[index]))
+                squareAttacks[index] = self.pieceAttacks(index, mailbox[index], occupancyBb)
+            sliders &= sliders - 1
+        pieceBbs[WHITEATTACKS] = self.unionAttacks(pieceBbs[WHITE])
+        pieceBbs[BLACKATTACKS] = self.unionAttacks(pieceBbs[BLACK])
+
+        if self.verifyAttacks and (pieceBbs[WHITEATTACKS] != self.attackedSquares(WHITE) or pieceBbs[BLACKATTACKS] != self.attackedSquares(BLACK)):
+            raise RuntimeError("incremental attack maps do not match a full recompute")
+        if self.verifyAttacks and self.zobristKey != self.computeZobristKey():
+            raise RuntimeError("incremental zobrist key does not match a full recompute")
+        if self.verifyAttacks and self.evalScore != self.computeEvalScore():
+            raise RuntimeError("incremental evalScore does not match a full recompute")
+
+    # takes back the last move made with push() or makeMove()
+    def pop(self):
+        (start, end, piece, captured, captureIndex, whiteEnpassant, blackEnpassant, whiteAtk, blackAtk, changes,
+         self.zobristKey, self.evalScore, self.castlingRights, self.halfmoveClock) = self.moveStack.pop()
+        mailbox = self.mailbox
+        pieceBbs = self.pieceBbs
+        friendly = piece & BLACK
+
+        pieceBbs[piece] ^= 0b1 << start
+        pieceBbs[mailbox[end]] ^= 0b1 << end
+        pieceBbs[friendly] ^= 0b1 << start | 0b1 << end
+        mailbox[start], mailbox[end] = piece, EMPTY
+        if captured != EMPTY:
+            mailbox[captureIndex] = captured
+            pieceBbs[captured] ^= 0b1 << captureIndex
+            pieceBbs[friendly ^ BLACK] ^= 0b1 << captureIndex
+        if piece & 7 == KING and (end - start == 2 or start - end == 2):
+            rookStart, rookEnd = CASTLINGROOKS[end]
+            rook = friendly | ROOK
+            pieceBbs[rook] ^= 0b1 << rookStart | 0b1 << rookEnd
+            pieceBbs[friendly] ^= 0b1 << rookStart | 0b1 << rookEnd
+            mailbox[rookStart], mailbox[rookEnd] = rook, EMPTY
+        if friendly == BLACK:
+            self.fullmoveNumber -= 1
+
+        self.whiteEnpassant = whiteEnpassant
+        self.blackEnpassant = blackEnpassant
+        pieceBbs[WHITEATTACKS] = whiteAtk
+        pieceBbs[BLACKATTACKS] = blackAtk
+        squareAttacks = self.squareAttacks
+        for index, attackBb in reversed(changes):
+            squareAttacks[index] = attackBb
+        self.whiteToMove = not self.whiteToMove
 
     # Generates a bitboard of all possible moves of a queen taking blockers into account
     # includes piece capture moves
@@ -477,185 +1070,261 @@ class Board:
     def queenAttack(self, index, isBlack: bool):
         return self.rookAttack(index, isBlack) | self.bishopAttack(index, isBlack)
 
-    # Calls makeMove on every possible pseudovalid moves of the piece at the given index.
-    # If the king is in check after the pseudovalid move, that move bit is toggled off
-    # returns a bitboard of all the legal moves
-    def legalMoves(self, index):
-        legalBb = self.pseudovalidMoves(index)
-        tempBb = legalBb #temporary bitboard used to iterate all the bits on a bitboard.
-        enemyatk = 'white'
-        king = 'k'
-        if (self.board[index].isupper()):
-            enemyatk = 'black'
-            king = 'K'
-
-        while tempBb > 0:
-            end = self.bitboard2Index(tempBb)
-            prevBoardStart, prevBoardEnd = self.board[index], self.board[end]           #Storing initial board and piece bitboards
-            prevStartBb = self.bitboards[self.board[index]]
-            prevEndPiece = self.board[end]
-            prevWhiteBb = self.bitboards["white"]
-            prevBlackBb = self.bitboards["black"]
-            prevWhiteAtk = self.bitboards['whiteatk']
-            prevBlackAtk = self.bitboards['blackatk']
-            prevBlackEnpassant = self.blackEnpassant
-            prevWhiteEnpassant = self.whiteEnpassant
-            didEnpassant = 0 # 0 for no, 1 for white, -1 for black
-            
-            # if the move is enpassant, then we store the enemy bitboard?
-
-            if 0b1 << end & (self.blackEnpassant | self.whiteEnpassant):
-                if 0b1 << index & self.bitboards['p']:
-                    prevBoardEnd = self.board[end+8]
-                    prevEndPieceBb = self.bitboards[prevBoardEnd]
-                    didEnpassant = -1
-                elif 0b1 << index & self.bitboards['P']:
-                    prevBoardEnd = self.board[end-8]
-                    prevEndPieceBb = self.bitboards[prevBoardEnd]
-                    didEnpassant = 1
-            elif prevEndPiece != ".":
-                prevEndPieceBb = self.bitboards[self.board[end]]
-            
-            if end // 8 == 0 and 0b1 << index & self.bitboards['p']:
-                previousQueenBb = self.bitboards['q']
-            elif end // 8 == 7 and 0b1 << index & self.bitboards['P']:
-                previousQueenBb = self.bitboards['Q']
-
-        
-
-            self.makeMove(index, end, True)
-
-            enemyatkBb = self.attackedSquares(enemyatk)
-
-            if(self.bitboards[king] & enemyatkBb):        #Checks if king is in check
-                legalBb ^= 0b1 << end
-
-            self.board[index] = prevBoardStart         # restoring board and piece bitboards to initial positions
-            self.bitboards[self.board[index]]  = prevStartBb
-            if didEnpassant < 0:
-                self.board[end] = '.'
-                self.board[end + 8] = prevBoardEnd
-                self.bitboards[prevBoardEnd] = prevEndPieceBb
-            elif didEnpassant > 0:
-                self.board[end] = '.'
-                self.board[end - 8] = prevBoardEnd
-                self.bitboards[prevBoardEnd] = prevEndPieceBb
-            elif prevEndPiece != ".":
-                self.board[end] = prevBoardEnd
-                self.bitboards[prevBoardEnd] = prevEndPieceBb
-            else:
-                self.board[end] = '.'
-                self.bitboards[end] = 0
-            self.bitboards["white"] = prevWhiteBb
-            self.bitboards["black"] = prevBlackBb
-            self.bitboards['whiteatk'] = prevWhiteAtk
-            self.bitboards['blackatk'] = prevBlackAtk
-            self.blackEnpassant = prevBlackEnpassant
-            self.whiteEnpassant = prevWhiteEnpassant
-            tempBb = self.toggleBit(tempBb, end)
-        return legalBb
-
     # Returns a bitboard of the pseudovalid moves a piece could make at the given index.
     # wrapper function for all the move bitboard generators
     def pseudovalidMoves(self, index):
-        temp = self.board[index]
-        if temp == "p":
-            return self.pawnMoves(index)
-        elif temp == "n":
-            return self.validKnightMoves(index, True)
-        elif temp == "q":
-            return self.queenAttack(index, True)
-        elif temp == "b":
-            return self.bishopAttack(index, True)
-        elif temp == "r":
-            return self.rookAttack(index, True)
-        elif temp == "k":
-            return self.validKingMoves(index, True)
-        elif temp == "P":
+        piece = self.mailbox[index]
+        isBlack = piece & BLACK == BLACK
+        pieceType = piece & 7
+        if pieceType == PAWN:
             return self.pawnMoves(index)
-        elif temp == "N":
-            return self.validKnightMoves(index, False)
-        elif temp == "Q":
-            return self.queenAttack(index, False)
-        elif temp == "B":
-            return self.bishopAttack(index, False)
-        elif temp == "R":
-            return self.rookAttack(index, False)
-        elif temp == "K":
-            return self.validKingMoves(index, False)
+        elif pieceType == KNIGHT:
+            return self.validKnightMoves(index, isBlack)
+        elif pieceType == QUEEN:
+            return self.queenAttack(index, isBlack)
+        elif pieceType == BISHOP:
+            return self.bishopAttack(index, isBlack)
+        elif pieceType == ROOK:
+            return self.rookAttack(index, isBlack)
+        elif pieceType == KING:
+            return self.validKingMoves(index, isBlack)
         else:
             return 0
 
     # returns bitboard of all legal squares the king can move to
     def validKingMoves(self, index, isBlack):
         if isBlack:
-            return (self.kingMoves[index] & (self.bitboards["whiteatk"] | self.bitboards["black"])) ^ self.kingMoves[index]
-        return (self.kingMoves[index] & (self.bitboards["blackatk"] | self.bitboards["white"])) ^ self.kingMoves[index]
-
-    # the function returns the status of the game (Checkmate, stalemate, check, or nothing)
-    def check(self, index, isBlack):
-        moves = self.legalMoves(index)
+            return (self.kingMoves[index] & (self.pieceBbs[WHITEATTACKS] | self.pieceBbs[BLACK])) ^ self.kingMoves[index]
+        return (self.kingMoves[index] & (self.pieceBbs[BLACKATTACKS] | self.pieceBbs[WHITE])) ^ self.kingMoves[index]
+
+    # returns True if a piece of the given color attacks index with the given occupancy
+    # works backwards from index: e.g. a rook attacks index exactly when a rook on index would attack the rook
+    def isSquareAttacked(self, index, byBlack, occupancyBb):
+        pieceBbs = self.pieceBbs
+        if byBlack:
+            color = BLACK
+            pawnAttacks = self.whitePawnAttacks
+        else:
+            color = WHITE
+            pawnAttacks = self.blackPawnAttacks
+        pawns, knights, bishops = pieceBbs[color | PAWN], pieceBbs[color | KNIGHT], pieceBbs[color | BISHOP]
+        rooks, queens, king = pieceBbs[color | ROOK], pieceBbs[color | QUEEN], pieceBbs[color | KING]
+        return bool(pawnAttacks[index] & pawns or self.knightMoves[index] & knights or self.kingMoves[index] & king
+                    or self.bishopMagicAttack(index, occupancyBb) & (bishops | queens)
+                    or self.rookMagicAttack(index, occupancyBb) & (rooks | queens))
+
+    # Generates all legal moves of a color (the side to move by default) without making any trial moves. The moves are
+    # appended to moves, a list or array('H') that can be reused between calls, or to a new list, which is returned.
+    # A pawn move to the last rank is added once for each piece it may promote to.
+    # It works out once per position:
+    #   - the checkers, the enemy pieces attacking the king
+    #   - the check mask, the squares a piece other than the king may move to: anywhere when not in check, the checker
+    #     and the squares between it and the king when in single check, nowhere when in double check
+    #   - the pinned pieces and the ray each one may move along: the squares between the king and the pinning slider
+    #     plus the slider itself
+    # King moves are checked with the king removed from the occupancy, so the king cannot step back along the ray of a
+    # slider that checks it. Castling is only added when not in check, from the attack map of the enemy. En passant can
+    # uncover a check along the rank of both pawns, so it is the one move that is still tried with push() and pop().
+    def generateLegalMoves(self, isBlack=None, moves=None):
+        if moves is None:
+            moves = []
+        if isBlack is None:
+            isBlack = not self.whiteToMove
+        pieceBbs = self.pieceBbs
+        mailbox = self.mailbox
         if isBlack:
-            # print("isBlack is True,")
-            king = self.bitboards["k"]
-            oppAtk = self.attackedSquares("white")
+            color, enemyColor = BLACK, WHITE
+            pawnAttacks = self.blackPawnAttacks
+            enpassant = self.whiteEnpassant
+        else:
+            color, enemyColor = WHITE, BLACK
+            pawnAttacks = self.whitePawnAttacks
+            enpassant = self.blackEnpassant
+        own, enemy = pieceBbs[color], pieceBbs[enemyColor]
+        kingBb = pieceBbs[color | KING]
+        enemyPawns, enemyKnights = pieceBbs[enemyColor | PAWN], pieceBbs[enemyColor | KNIGHT]
+        enemyDiagonal = pieceBbs[enemyColor | BISHOP] | pieceBbs[enemyColor | QUEEN]
+        enemyStraight = pieceBbs[enemyColor | ROOK] | pieceBbs[enemyColor | QUEEN]
+        if not kingBb:
+            return moves
+        occupancyBb = own | enemy
+        kingIndex = self.bitboard2Index(kingBb)
+        betweenMasks = self.betweenMasks[kingIndex]
+
+        # king moves
+        targets = self.kingMoves[kingIndex] & ~own
+        withoutKing = occupancyBb ^ kingBb
+        while targets:
+            end = (targets & -targets).bit_length() - 1
+            if not self.isSquareAttacked(end, not isBlack, withoutKing):
+                moves.append(kingIndex | end << 6)
+            targets &= targets - 1
+
+        checkers = (pawnAttacks[kingIndex] & enemyPawns | self.knightMoves[kingIndex] & enemyKnights
+                    | self.bishopMagicAttack(kingIndex, occupancyBb) & enemyDiagonal
+                    | self.rookMagicAttack(kingIndex, occupancyBb) & enemyStraight)
+        if checkers & (checkers - 1):
+            return moves
+        if checkers:
+            checkMask = checkers | betweenMasks[self.bitboard2Index(checkers)]
         else:
-            # print("isBlack is false")
-            king = self.bitboards["K"]
-            oppAtk = self.attackedSquares("black")
-        # brd.printBitboard(king)
-        # print()
-        # brd.printBitboard(oppAtk)
-        # Checkmate not working right, need to ensure that oppatk & King bitboard > 1 for checkmate
-
-        if moves == 0 and king & oppAtk > 0:
-            if isBlack:
-                for key in ('p', 'q', 'r', 'b', 'n'):
-                    tempBb = self.bitboards[key]
-                    while tempBb > 0:
-                        i = self.bitboard2Index(tempBb)
-                        if self.legalMoves(i) > 0:
-                            print('Check')
-                            return -2
-                        tempBb = self.toggleBit(tempBb, i)
+            checkMask = 18446744073709551615
+            rights = self.castlingRights
+            if rights:
+                enemyAttacks = pieceBbs[enemyColor | ATTACKS]
+                for right, kingStart, kingEnd, rookStart, rookEnd, emptyBb, safeBb in CASTLINGMOVES[color]:
+                    if (rights & right and kingIndex == kingStart and mailbox[rookStart] == color | ROOK
+                            and not occupancyBb & emptyBb and not enemyAttacks & safeBb):
+                        moves.append(kingStart | kingEnd << 6 | CASTLINGFLAG << 14)
+
+        # a slider that would attack the king if only enemy pieces blocked it pins a piece when exactly one of our
+        # pieces stands between them
+        pinRays = {}
+        snipers = (self.bishopMagicAttack(kingIndex, enemy) & enemyDiagonal) | (self.rookMagicAttack(kingIndex, enemy) & enemyStraight)
+        while snipers:
+            sniper = (snipers & -snipers).bit_length() - 1
+            blockers = betweenMasks[sniper] & occupancyBb
+            if blockers and not blockers & (blockers - 1) and blockers & own:
+                pinRays[self.bitboard2Index(blockers)] = betweenMasks[sniper] | 0b1 << sniper
+            snipers &= snipers - 1
+
+        pieces = own ^ kingBb
+        while pieces:
+            start = (pieces & -pieces).bit_length() - 1
+            pieceType = mailbox[start] & 7
+            enpassantMove = 0
+            if pieceType == PAWN:
+                targets = self.pawnMoves(start)
+                enpassantMove = targets & enpassant
+                targets ^= enpassantMove
+            elif pieceType == KNIGHT:
+                targets = self.knightMoves[start] & ~own
             else:
-                for key in ('P', 'Q', 'R', 'B', 'N'):
-                    tempBb = self.bitboards[key]
-                    while tempBb > 0:
-                        i = self.bitboard2Index(tempBb)
-                        if self.legalMoves(i) > 0:
-                            print('Check')
-                            return -2
-                        tempBb = self.toggleBit(tempBb, i)
-            print("Checkmate")
-            return -1
-        elif king & oppAtk > 0:
-            print('Check')
-            return -2
-        elif moves == 0b1 << index:
-            print("Stalemate")
-            return 0
-        # print("Not in Check")
-        return 1
-
-    # returns an integer that has its bit order reversed, endianess is reversed.
-
-    def bitSwap(self, n):
-        # return 18446744073709551615 - n (one's complement)
-        result = 0
-        for i in range(64):
-            result <<= 1
-            result |= n & 1
-            n >>= 1
-        return result
+                targets = self.squareAttacks[start] & ~own
+            targets &= checkMask
+            if start in pinRays:
+                targets &= pinRays[start]
+            if pieceType == PAWN and targets & PROMOTIONRANKS:
+                promotions = targets & PROMOTIONRANKS
+                targets ^= promotions
+                while promotions:
+                    move = start | ((promotions & -promotions).bit_length() - 1) << 6 | PROMOTIONFLAG << 14
+                    moves.extend((move, move | 1 << 12, move | 2 << 12, move | 3 << 12))
+                    promotions &= promotions - 1
+            while targets:
+                moves.append(start | ((targets & -targets).bit_length() - 1) << 6)
+                targets &= targets - 1
+            if enpassantMove:
+                move = start | self.bitboard2Index(enpassantMove) << 6 | ENPASSANTFLAG << 14
+                self.push(move)
+                if not self.inCheck(isBlack):
+                    moves.append(move)
+                self.pop()
+            pieces &= pieces - 1
+        return moves
+
+    # returns True if the king of the given color is attacked
+    def inCheck(self, isBlack):
+        if isBlack:
+            return self.pieceBbs[BLACKKING] & self.pieceBbs[WHITEATTACKS] != 0
+        return self.pieceBbs[WHITEKING] & self.pieceBbs[BLACKATTACKS] != 0
+
+    # Returns the captures (including en passant) and the queen promotions of the side to move, appended to moves or to
+    # a new list. Like pseudovalidMoves, moves that leave the king in check are not removed.
+    # Used by the quiescence search, which only looks at these moves and so does not need all legal moves.
+    def captureMoves(self, moves=None):
+        if moves is None:
+            moves = []
+        if self.whiteToMove:
+            pieces, enemyBb = self.pieceBbs[WHITE], self.pieceBbs[BLACK]
+            pawnTargets = enemyBb | self.blackEnpassant | self.rankMasks[7]
+        else:
+            pieces, enemyBb = self.pieceBbs[BLACK], self.pieceBbs[WHITE]
+            pawnTargets = enemyBb | self.whiteEnpassant | self.rankMasks[0]
+        enpassant = self.whiteEnpassant | self.blackEnpassant
+        mailbox = self.mailbox
+        squareAttacks = self.squareAttacks
+        while pieces:
+            index = (pieces & -pieces).bit_length() - 1
+            if mailbox[index] & 7 == PAWN:
+                targets = self.pawnMoves(index) & pawnTargets
+                while targets:
+                    end = (targets & -targets).bit_length() - 1
+                    if 0b1 << end & PROMOTIONRANKS:
+                        moves.append(index | end << 6 | PROMOTIONFLAG << 14)
+                    elif 0b1 << end & enpassant:
+                        moves.append(index | end << 6 | ENPASSANTFLAG << 14)
+                    else:
+                        moves.append(index | end << 6)
+                    targets &= targets - 1
+            else:
+                targets = squareAttacks[index] & enemyBb
+                while targets:
+                    moves.append(index | ((targets & -targets).bit_length() - 1) << 6)
+                    targets &= targets - 1
+            pieces &= pieces - 1
+        return moves
+
+    # the function returns the status of the game (CHECKMATE, STALEMATE, CHECK, or INPLAY) for the given color
+    def check(self, index, isBlack):
+        if isBlack != (not self.whiteToMove):
+            return self.computeStatus(self.generateLegalMoves(isBlack), isBlack)
+        return self.gameStatus()
+
+    def computeStatus(self, moves, isBlack):
+        inCheck = self.inCheck(isBlack)
+        if not moves and inCheck:
+            return CHECKMATE
+        elif inCheck:
+            return CHECK
+        elif not moves:
+            return STALEMATE
+        return INPLAY
+
+    # Returns the legal moves of the side to move as a tuple. They are remembered with the status of the position by
+    # zobrist key, so the GUI asking again for the same position (on every click, for the status line and to check
+    # the move it makes) does not generate them again.
+    def cachedLegalMoves(self):
+        entry = self.legalMoveCache.get(self.zobristKey)
+        if entry is None:
+            moves = tuple(self.generateLegalMoves())
+            if len(self.legalMoveCache) >= LEGALMOVECACHESIZE:
+                self.legalMoveCache.clear()
+            entry = (moves, self.computeStatus(moves, not self.whiteToMove))
+            self.legalMoveCache[self.zobristKey] = entry
+        return entry[0]
+
+    # returns the status of the side to move (CHECKMATE, CHECK, STALEMATE or INPLAY)
+    def gameStatus(self):
+        self.cachedLegalMoves()
+        return self.legalMoveCache[self.zobristKey][1]
+
+    # Returns True if the side to move has a legal move. A king move that is not into check is looked for first, which
+    # is enough to answer in most positions without generating every move.
+    def hasAnyLegalMove(self):
+        entry = self.legalMoveCache.get(self.zobristKey)
+        if entry is not None:
+            return len(entry[0]) > 0
+        isBlack = not self.whiteToMove
+        kingBb = self.pieceBbs[BLACKKING if isBlack else WHITEKING]
+        if kingBb:
+            kingIndex = self.bitboard2Index(kingBb)
+            own = self.pieceBbs[BLACK if isBlack else WHITE]
+            withoutKing = (self.pieceBbs[WHITE] | self.pieceBbs[BLACK]) ^ kingBb
+            targets = self.kingMoves[kingIndex] & ~own
+            while targets:
+                if not self.isSquareAttacked(self.bitboard2Index(targets), not isBlack, withoutKing):
+                    return True
+                targets &= targets - 1
+        return len(self.cachedLegalMoves()) > 0
 
     # first AND knight moves and friendly team pieces to get overlap
     # then XOR knight moves with overlap to get valid knight moves
     def validKnightMoves(self, index, isBlack):
         if isBlack:
-            friendlyColor = self.bitboards["black"]
+            friendlyColor = self.pieceBbs[BLACK]
         else:
-            friendlyColor = self.bitboards["white"]
+            friendlyColor = self.pieceBbs[WHITE]
         overlap = self.knightMoves[index] & friendlyColor
         return self.knightMoves[index] ^ overlap
 
@@ -664,52 +1333,74 @@ class Board:
         return bitboard ^ 0b1 << index
 
     # returns bitboard that has a 1 on each square that has a piece on it
-    # deprecated (use self.bitboards["(white/black)"]) instead
+    # deprecated (use self.pieceBbs[WHITE/BLACK]) instead
     def pieceMask(self):
-        pieceMask = 0b0
-        for key in self.bitboards.keys():
-            if key in ("R", "N", "B", "Q", "K", "P", "r", "n", "b", "q", "k", "p"):
-                pieceMask |= self.bitboards[key]
-        return pieceMask
-
-    # given a boolean isBlack, if true, then generates bitboard mask of all white pieces
-    # otherwise generates bitboard mask for black pieces
+        return self.pieceBbs[WHITE] | self.pieceBbs[BLACK]
+
+    # given a boolean isBlack, if true, then returns bitboard mask of all white pieces
+    # otherwise returns bitboard mask for black pieces
     def enemyMask(self, isBlack):
-        enemyMask = 0b0
         if isBlack:
-            for key in self.bitboards.keys():
-                if key.isupper():
-                    enemyMask |= self.bitboards[key]
-        else:
-            for key in self.bitboards.keys():
-                if key.islower():
-                    enemyMask |= self.bitboards[key]
-        return enemyMask
+            return self.pieceBbs[WHITE]
+        return self.pieceBbs[BLACK]
+
+    # returns the squares attacked by the piece on index for the given occupancy, including squares of friendly pieces
+    def pieceAttacks(self, index, piece, occupancyBb):
+        if piece == WHITEPAWN:
+            return self.whitePawnAttacks[index]
+        elif piece == BLACKPAWN:
+            return self.blackPawnAttacks[index]
+        pieceType = piece & 7
+        if pieceType == KNIGHT:
+            return self.knightMoves[index]
+        elif pieceType == BISHOP:
+            return self.bishopMagicAttack(index, occupancyBb)
+        elif pieceType == ROOK:
+            return self.rookMagicAttack(index, occupancyBb)
+        elif pieceType == QUEEN:
+            return self.rookMagicAttack(index, occupancyBb) | self.bishopMagicAttack(index, occupancyBb)
+        elif pieceType == KING:
+            return self.kingMoves[index]
+        return 0
 
+    # Full recompute of the squares attacked by a color (WHITE or BLACK) from the pieces on the board.
+    # push() keeps pieceBbs[WHITEATTACKS/BLACKATTACKS] up to date incrementally; this is the reference they are
+    # verified against.
     def attackedSquares(self, color):
-        pieceBb = self.bitboards[color]
+        occupancyBb = self.pieceBbs[WHITE] | self.pieceBbs[BLACK]
+        pieceBb = self.pieceBbs[color]
         attacked = 0b0
         while pieceBb > 0:
             index = self.bitboard2Index(pieceBb)
-            pieceBb ^= 0b1 << index
-            if 0b1 << index & self.bitboards['P']:
-                if index % 8 == 0:
-                    attacked |= 0b1 << (index + 9)
-                elif index % 8 == 7:
-                    attacked |= 0b1 << (index + 7)
-                else:
-                    attacked |= 0b1 << (index + 7) | 0b1 << (index + 9)
-            elif 0b1 << index & self.bitboards['p']:
-                if index // 8 == 0:
-                    continue
-                elif index % 8 == 0:
-                    attacked |= 0b1 << (index - 7)
-                elif index % 8 == 7:
-                    attacked |= 0b1 << (index - 9)
-                else:
-                    attacked |= 0b1 << (index - 7) | 0b1 << (index - 9)
-            else:
-                attacked |= self.pseudovalidMoves(index)
+            attacked |= self.pieceAttacks(index, self.mailbox[index], occupancyBb)
+            pieceBb &= pieceBb - 1
+        return attacked
+
+    # rebuilds squareAttacks and the attack bitboards of both colors from scratch, visiting only the occupied squares
+    def refreshAttacks(self):
+        pieceBbs = self.pieceBbs
+        mailbox = self.mailbox
+        squareAttacks = self.squareAttacks
+        squareAttacks[:] = [0] * 64
+        occupancyBb = pieceBbs[WHITE] | pieceBbs[BLACK]
+        attacked = [0] * 16
+        pieces = occupancyBb
+        while pieces:
+            index = (pieces & -pieces).bit_length() - 1
+            piece = mailbox[index]
+            squareAttacks[index] = attackBb = self.pieceAttacks(index, piece, occupancyBb)
+            attacked[piece & BLACK] |= attackBb
+            pieces &= pieces - 1
+        pieceBbs[WHITEATTACKS] = attacked[WHITE]
+        pieceBbs[BLACKATTACKS] = attacked[BLACK]
+
+    # returns the union of squareAttacks of the pieces in pieceBb
+    def unionAttacks(self, pieceBb):
+        squareAttacks = self.squareAttacks
+        attacked = 0b0
+        while pieceBb:
+            attacked |= squareAttacks[(pieceBb & -pieceBb).bit_length() - 1]
+            pieceBb &= pieceBb - 1
         return attacked
 
     # returns the board index of the smallest set bit given a bitboard
@@ -717,38 +1408,115 @@ class Board:
     def bitboard2Index(self, bitboard):
         return (bitboard & -bitboard).bit_length()-1
 
-    # takes a FEN string and assigns it to the fen of the Board
-    # also populates the board variable of Board according to the given FEN string
+    # Sets up the position of a FEN string: the pieces, the side to move, the castling rights, the en passant square
+    # and the clocks. The fields after the piece placement may be left out (EPD positions have no clocks) and default
+    # to white to move, no castling, no en passant square, 0 and 1. Castling rights whose king or rook is not on its
+    # starting square are dropped. The mailbox, bitboards, zobrist key and evalScore are filled in one pass over the
+    # piece placement. Raises ValueError if the string is not a FEN.
     def fen2Board(self, fen):
-        self.fen = fen
+        fields = fen.split()
+        if not fields or len(fields) > 6:
+            raise ValueError(f"invalid FEN: {fen!r}")
+        mailbox = self.mailbox
+        mailbox[:] = bytes(64)
+        pieceBbs = self.pieceBbs
+        pieceBbs[:] = [0] * 16
+        zobristPieces = self.zobristPieces
+        pieceSquareValues = self.pieceSquareValues
+        key = 0
+        score = 0
+
+        # FEN lists the ranks from the 8th down to the 1st, each from the a file to the h file
+        ranks = fields[0].split("/")
+        if len(ranks) != 8:
+            raise ValueError(f"invalid FEN: {fen!r}")
+        for rankIndex, rank in zip(range(56, -1, -8), ranks):
+            index = rankIndex
+            for char in rank:
+                piece = PIECECODES.get(char)
+                if piece is None:
+                    # a digit skips that many empty squares, anything else makes the rank too long
+                    index += EMPTYRUNS.get(char, 9)
+                    continue
+                if index >= rankIndex + 8:
+                    raise ValueError(f"invalid FEN: {fen!r}")
+                mailbox[index] = piece
+                pieceBbs[piece] |= 0b1 << index
+                key ^= zobristPieces[piece][index]
+                score += pieceSquareValues[piece][index]
+                index += 1
+            if index != rankIndex + 8:
+                raise ValueError(f"invalid FEN: {fen!r}")
+        pieceBbs[WHITE] = pieceBbs[WHITEPAWN] | pieceBbs[WHITEKNIGHT] | pieceBbs[WHITEBISHOP] | pieceBbs[WHITEROOK] | pieceBbs[WHITEQUEEN] | pieceBbs[WHITEKING]
+        pieceBbs[BLACK] = pieceBbs[BLACKPAWN] | pieceBbs[BLACKKNIGHT] | pieceBbs[BLACKBISHOP] | pieceBbs[BLACKROOK] | pieceBbs[BLACKQUEEN] | pieceBbs[BLACKKING]
+
+        side, castling, enpassant, halfmove, fullmove = fields[1:] + ["w", "-", "-", "0", "1"][len(fields) - 1:]
+        if side not in ("w", "b") or not halfmove.isdigit() or not fullmove.isdigit():
+            raise ValueError(f"invalid FEN: {fen!r}")
+        rights = 0
+        if castling != "-":
+            for char in castling:
+                if char not in CASTLINGCHARS:
+                    raise ValueError(f"invalid FEN: {fen!r}")
+                rights |= 0b1 << CASTLINGCHARS.index(char)
+        for castlings in CASTLINGMOVES.values():
+            for right, kingStart, kingEnd, rookStart, rookEnd, emptyBb, safeBb in castlings:
+                color = WHITE if kingStart == 4 else BLACK
+                if mailbox[kingStart] != color | KING or mailbox[rookStart] != color | ROOK:
+                    rights &= ~right
 
-        # splits given FEN string by whitespaces into a list
-        fenList = self.fen.split()
-
-        # fills board with "."
-        self.board = ["." for i in range(64)]
-
-        boardIndex = 0
-        fenIndex = 0
-        while fenIndex < len(fenList[0]):
-            # fenList[0] contains only the board representation portion of the FEN string
-            fenCurr = fenList[0][fenIndex]
-            if fenCurr.isalpha():                   # checks to see if fenCurr is a letter
-                self.board[boardIndex] = fenCurr
-                fenIndex += 1
-                boardIndex += 1
-            elif fenCurr == '/':                    # increments fenIndex if fenCurr is "/"
-                fenIndex += 1
-            else:                                   # fenCurr is a number so fenCurr amount of squares are skipped
-                fenIndex += 1
-                boardIndex += int(fenCurr)
+        self.fen = fen
+        self.whiteToMove = side == "w"
+        self.castlingRights = rights
+        self.halfmoveClock = int(halfmove)
+        self.fullmoveNumber = max(1, int(fullmove))
+        # the en passant square is behind the pawn that just moved two squares, so it belongs to the side not to move
+        self.whiteEnpassant = 0
+        self.blackEnpassant = 0
+        if enpassant != "-":
+            if enpassant not in self.fileRank2index or enpassant[1] != ("6" if self.whiteToMove else "3"):
+                raise ValueError(f"invalid FEN: {fen!r}")
+            if self.whiteToMove:
+                self.blackEnpassant = 0b1 << self.fileRank2index[enpassant]
+            else:
+                self.whiteEnpassant = 0b1 << self.fileRank2index[enpassant]
+            key ^= self.zobristEnpassant[self.fileRank2index[enpassant] % 8]
+        if not self.whiteToMove:
+            key ^= self.zobristBlackToMove
+        self.zobristKey = key ^ self.zobristCastling[rights]
+        self.evalScore = score
+        self.moveStack = []
+        self.legalMoveCache = {}
+        self.refreshAttacks()
+
+    # returns the FEN of the position
+    def toFen(self):
+        mailbox = self.mailbox
+        ranks = []
+        for rank in range(56, -1, -8):
+            row = ""
+            empty = 0
+            for piece in mailbox[rank:rank + 8]:
+                if piece == EMPTY:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                row += PIECECHARS[piece]
+            ranks.append(row + str(empty) if empty else row)
+        castling = "".join(char for bit, char in enumerate(CASTLINGCHARS) if self.castlingRights >> bit & 1) or "-"
+        enpassant = self.whiteEnpassant | self.blackEnpassant
+        enpassant = SQUARENAMES[self.bitboard2Index(enpassant)] if enpassant else "-"
+        return (f"{'/'.join(ranks)} {'w' if self.whiteToMove else 'b'} {castling} {enpassant} "
+                f"{self.halfmoveClock} {self.fullmoveNumber}")
 
     def printBoard(self):
         count = 0
         i = 56
         while i > -1:
             while count < 8:
-                print(self.board[i], end=" ")
+                print(PIECECHARS[self.mailbox[i]], end=" ")
                 i += 1
                 count += 1
             i -= 16
@@ -769,7 +1537,32 @@ class Board:
             print()
 
 
-########################################
-brd = Board()
-brd.board2Bitboard()
-brd.printBitboard(brd.bitboards['whiteatk'])
\ No newline at end of file
+# Splits an EPD line into its position (the first four fields of a FEN) and its operations, as {opcode: operand} with
+# the quotes around a string operand removed, e.g. 'r1bqkbnr/... w KQkq - bm Nf3; id "test 1";' gives
+# {"bm": "Nf3", "id": "test 1"}. Raises ValueError if the line has fewer than four fields.
+def splitEpd(line):
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError(f"invalid EPD: {line!r}")
+    operations = {}
+    if len(fields) == 5:
+        for operation in fields[4].split(";"):
+            opcode, space, operand = operation.strip().partition(" ")
+            if opcode:
+                operations[opcode] = operand.strip().strip('"')
+    return " ".join(fields[:4]), operations
+
+
+# Yields (board, operations) for each EPD line of the file at path, skipping empty lines and # comments. Lines are
+# read in large buffered chunks and the same board (a new Board unless one is given) is set up again for every line,
+# so streaming a big file creates no Board per position: keep a copy() of the board to hold on to a position.
+def readEpd(path, board=None):
+    if board is None:
+        board = Board()
+    with open(path, "r", buffering=1 << 20) as epdFile:
+        for line in epdFile:
+            if not line.strip() or line.startswith("#"):
+                continue
+            fen, operations = splitEpd(line)
+            board.fen2Board(fen)
+            yield board, operations
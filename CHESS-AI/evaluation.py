@@ -0,0 +1,90 @@
+# Material and piece-square values used by the evaluation, in centipawns.
+# The Board keeps the sum of these values for the pieces on the board up to date in push() and pop() (Board.evalScore),
+# so AI.evaluate does not have to look at every piece.
+# Tables are from the Simplified Evaluation Function:
+#   https://www.chessprogramming.org/Simplified_Evaluation_Function
+
+PIECEVALUES = {'p': 100, 'n': 320, 'b': 330, 'r': 500, 'q': 900, 'k': 20000}
+
+# centipawns per square in the attack maps of a side that is not occupied by its own pieces
+MOBILITYWEIGHT = 4
+
+# Each table is written as seen from white's side of the board: the first row is the 8th rank, from the a file to the
+# h file. Black uses the same tables mirrored vertically.
+PAWNTABLE = (
+     0,   0,   0,   0,   0,   0,   0,   0,
+    50,  50,  50,  50,  50,  50,  50,  50,
+    10,  10,  20,  30,  30,  20,  10,  10,
+     5,   5,  10,  25,  25,  10,   5,   5,
+     0,   0,   0,  20,  20,   0,   0,   0,
+     5,  -5, -10,   0,   0, -10,  -5,   5,
+     5,  10,  10, -20, -20,  10,  10,   5,
+     0,   0,   0,   0,   0,   0,   0,   0)
+
+KNIGHTTABLE = (
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20,   0,   0,   0,   0, -20, -40,
+    -30,   0,  10,  15,  15,  10,   0, -30,
+    -30,   5,  15,  20,  20,  15,   5, -30,
+    -30,   0,  15,  20,  20,  15,   0, -30,
+    -30,   5,  10,  15,  15,  10,   5, -30,
+    -40, -20,   0,   5,   5,   0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50)
+
+BISHOPTABLE = (
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,  10,  10,   5,   0, -10,
+    -10,   5,   5,  10,  10,   5,   5, -10,
+    -10,   0,  10,  10,  10,  10,   0, -10,
+    -10,  10,  10,  10,  10,  10,  10, -10,
+    -10,   5,   0,   0,   0,   0,   5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20)
+
+ROOKTABLE = (
+     0,   0,   0,   0,   0,   0,   0,   0,
+     5,  10,  10,  10,  10,  10,  10,   5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+     0,   0,   0,   5,   5,   0,   0,   0)
+
+QUEENTABLE = (
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,   5,   5,   5,   0, -10,
+     -5,   0,   5,   5,   5,   5,   0,  -5,
+      0,   0,   5,   5,   5,   5,   0,  -5,
+    -10,   5,   5,   5,   5,   5,   0, -10,
+    -10,   0,   5,   0,   0,   0,   0, -10,
+    -20, -10, -10,  -5,  -5, -10, -10, -20)
+
+KINGTABLE = (
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+     20,  20,   0,   0,   0,   0,  20,  20,
+     20,  30,  10,   0,   0,  10,  30,  20)
+
+TABLES = {'p': PAWNTABLE, 'n': KNIGHTTABLE, 'b': BISHOPTABLE, 'r': ROOKTABLE, 'q': QUEENTABLE, 'k': KINGTABLE}
+
+
+# Returns {piece character: tuple of 64 values} with the material plus piece-square value of that piece on each board
+# index (a1 = 0). White values are positive and black values negative, so their sum over the board is the score from
+# white's point of view.
+def pieceSquareValues():
+    values = {}
+    for piece, table in TABLES.items():
+        white, black = [], []
+        for index in range(64):
+            rank, file = index // 8, index % 8
+            white.append(PIECEVALUES[piece] + table[(7 - rank) * 8 + file])
+            black.append(-(PIECEVALUES[piece] + table[rank * 8 + file]))
+        values[piece.upper()] = tuple(white)
+        values[piece] = tuple(black)
+    return values
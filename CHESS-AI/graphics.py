@@ -1,7 +1,15 @@
 import pygame
 import chessboard as cb
 import ai
+import book
+import bitbase
 import math
+import threading
+
+# events posted by the thread the AI searches on: AIPROGRESSEVENT after each completed depth of the search (with the
+# attributes depth, score, move and nodes) and AIMOVEEVENT with the chosen move when the search is over
+AIPROGRESSEVENT = pygame.USEREVENT + 1
+AIMOVEEVENT = pygame.USEREVENT + 2
 
 
 class GUI:
@@ -31,43 +39,180 @@ class GUI:
 
         self.whitePOV = whitePOV
         self.boardObj = cb.Board()
-        self.ai = ai.AI(whitePOV)
+        # the AI plays its first moves from book.bin next to the modules if there is one, see book.py, and scores simple
+        # endgames with the bitbases if they have been generated, see bitbase.py
+        self.ai = ai.AI(whitePOV, book=book.openBook(), bitbases=bitbase.openBitbases())
         self.boardObj.board2Bitboard()
         self.selected = None
         self.legalMoves = []
         self.whitesTurn = True
+        # the AI searches on its own board in searchThread while the window keeps handling events
+        self.searchThread = None
+        self.searchTime = 2000
+        # (depth, score, move) of the last completed depth of the running search
+        self.searchInfo = None
+        # counts the searches started; progress events carry the count of their search, so the ones still queued from
+        # a search that was stopped are not drawn
+        self.searchId = 0
+        # While the human thinks, the AI ponders: it searches the position after the reply it expects (ponderMove, which
+        # is made on the AI's board) with no time limit. A ponder search that ends early waits for ponderRelease before
+        # it posts its move, and the move of a search that is thrown away is not posted at all (discardSearch).
+        self.ponderMove = None
+        self.ponderRelease = threading.Event()
+        self.discardSearch = False
+
+        # Rendering only redraws what changed. The checkerboard is drawn once onto background, squares are redrawn by
+        # copying their part of it, and the rectangles drawn in a frame are collected in dirtyRects and sent to the
+        # display with a single pygame.display.update(dirtyRects) by flushDisplay().
+        self.background = self.checkerPattern()
+        self.dirtyRects = []
+        # the piece characters as last drawn, and the squares drawn highlighted or with a legal move dot
+        self.drawnBoard = ["."] * 64
+        self.markedSquares = set()
+        self.infoFont = pygame.font.Font(pygame.font.get_default_font(), 25)
+        self.searchFont = pygame.font.Font(pygame.font.get_default_font(), 14)
+        # rendered surfaces of the info bar messages, which are few and repeat every turn
+        self.textCache = {}
 
     def main(self):
         run = True
+        clock = pygame.time.Clock()
         self.makeCoordMap()
         self.updateScreen()
         self.renderGameInfo()
+        self.flushDisplay()
         while run:
-            if not self.whitePOV and self.whitesTurn or self.whitePOV and not self.whitesTurn:
-                        move = self.ai.minimax(2, -float('inf'), float('inf'))[0]
-                        self.ai.boardObj.makeMove(move[0], move[1])
-                        self.makeMove(move[0], move[1])
-                        self.whitesTurn = not self.whitesTurn
-                        self.renderGameInfo()
+            # the AI searches on its turn until the game is over, when search() would have no move to give
+            aiToMove = self.whitesTurn != self.whitePOV
+            if self.searchThread is None and aiToMove and self.boardObj.gameStatus() in (cb.INPLAY, cb.CHECK):
+                self.startSearch()
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:  # exit button on top right
                     run = False
-                if event.type == pygame.MOUSEBUTTONUP:
+                if event.type == AIPROGRESSEVENT and event.searchId == self.searchId:
+                    self.searchInfo = (event.depth, event.score, event.move)
+                if event.type == AIMOVEEVENT:
+                    self.searchThread.join()
+                    self.searchThread = None
+                    self.searchInfo = None
+                    if event.move is None:
+                        # the game is over (or the search was stopped before its first depth): the turn stays with
+                        # the AI and no new search is started for it
+                        self.renderGameInfo()
+                    else:
+                        start, end = cb.moveStart(event.move), cb.moveEnd(event.move)
+                        promotion = cb.movePromotion(event.move) or cb.QUEEN
+                        self.ai.boardObj.makeMove(start, end, promotion=promotion)
+                        self.makeMove(start, end, promotion)
+                        self.whitesTurn = not self.whitesTurn
+                        self.startPondering(event.move)
+                        self.renderGameInfo()
+                # clicks are ignored while the AI is thinking about its own move
+                if event.type == pygame.MOUSEBUTTONUP and (self.searchThread is None or self.ponderMove is not None):
                     pos = pygame.mouse.get_pos()
                     index = self.mousePosToIndex(pos)
                     if index is None:
-                        self.updateScreen()
+                        self.renderPieces()
                         self.selected = None
                         self.legalMoves = None
                         continue
 
                     elif self.isMakingMove(index):
                         self.makeMove(self.selected, index)
-                        self.ai.boardObj.makeMove(self.selected, index)
+                        if self.ponderMove is not None:
+                            self.endPondering(self.selected, index)
+                        else:
+                            self.ai.boardObj.makeMove(self.selected, index)
                         self.whitesTurn = not self.whitesTurn
                         self.renderGameInfo()
                     else:
                         self.selectTile(index)
+            if self.searchThread is not None:
+                self.renderSearchInfo()
+            self.flushDisplay()
+            clock.tick(30)
+        self.stopSearch()
+
+    # starts the AI searching for its move on a background thread, or pondering with no time limit
+    def startSearch(self, ponder=False):
+        self.searchInfo = None
+        self.searchId += 1
+        self.ponderRelease.clear()
+        self.ai.clearStop()
+        self.searchThread = threading.Thread(target=self.searchWorker, args=(ponder, self.searchId), daemon=True)
+        self.searchThread.start()
+
+    # runs on the search thread, the results are posted back to the event loop as events
+    def searchWorker(self, ponder, searchId):
+        def progress(depth, score, move, nodes):
+            self.postSearchProgress(searchId, depth, score, move, nodes)
+
+        move = self.ai.search(time_ms=None if ponder else self.searchTime, progress=progress)[0]
+        if ponder:
+            self.ponderRelease.wait()
+        if not self.discardSearch:
+            pygame.event.post(pygame.event.Event(AIMOVEEVENT, move=move))
+
+    # After the AI played move, starts pondering on the reply its search expected (the second move of the principal
+    # variation), if there is one.
+    def startPondering(self, move):
+        pv = self.ai.pv
+        if len(pv) < 2 or pv[0] != move or pv[1] not in self.ai.boardObj.generateLegalMoves():
+            return
+        self.ponderMove = pv[1]
+        self.ai.boardObj.push(self.ponderMove)
+        self.startSearch(ponder=True)
+
+    # The human played start -> end while the AI was pondering. If it is the expected move, the ponder search goes on as
+    # the search for the AI's move, with the usual time counted from when it started pondering. Otherwise the ponder
+    # search is thrown away and the expected move taken back; the search for the AI's move then starts with the
+    # transposition table and move ordering history the ponder search has filled.
+    def endPondering(self, start, end):
+        ponderMove, self.ponderMove = self.ponderMove, None
+        if cb.moveStart(ponderMove) == start and cb.moveEnd(ponderMove) == end \
+                and cb.movePromotion(ponderMove) in (cb.EMPTY, cb.QUEEN):
+            self.ai.ponderHit(self.searchTime)
+            self.ponderRelease.set()
+            return
+        self.discardSearch = True
+        self.stopSearch()
+        self.discardSearch = False
+        self.ai.boardObj.pop()
+        self.ai.boardObj.makeMove(start, end)
+
+    def postSearchProgress(self, searchId, depth, score, move, nodes):
+        pygame.event.post(pygame.event.Event(AIPROGRESSEVENT, searchId=searchId, depth=depth, score=score, move=move,
+                                             nodes=nodes))
+
+    # stops a running search and waits for its thread to finish
+    def stopSearch(self):
+        if self.searchThread is not None:
+            self.ai.stop()
+            self.ponderRelease.set()
+            self.searchThread.join()
+            self.searchThread = None
+
+    # shows the depth, best move and node count of the running search at the bottom of the info bar
+    def renderSearchInfo(self):
+        y = self.BOARDSIZE + self.TILESIZE - 18
+        background = pygame.Rect(0, y, self.BOARDSIZE, 18)
+        pygame.draw.rect(self.WIN, (200, 200, 200), background)
+        nodes = self.ai.nodes + self.ai.qnodes
+        status = "Pondering..." if self.ponderMove is not None else "Thinking..."
+        if self.searchInfo is None:
+            message = f"{status}  {nodes} nodes"
+        else:
+            depth, score, move = self.searchInfo
+            message = f"{status}  depth {depth}  best {cb.move2Uci(move)}  score {score}  {nodes} nodes"
+        text = self.searchFont.render(message, True, (60, 60, 60))
+        self.WIN.blit(text, text.get_rect(center=(self.SCREENWIDTH / 2, y + 9)))
+        self.dirtyRects.append(background)
+
+    # sends the rectangles drawn since the last call to the display
+    def flushDisplay(self):
+        if self.dirtyRects:
+            pygame.display.update(self.dirtyRects)
+            self.dirtyRects = []
 
     # given char representation, return a scaled image of the piece (e.g. b -> white bishop PNG)
     def pieceToImg(self, piece):
@@ -96,23 +241,37 @@ class GUI:
                 y = (i >> 3) * self.TILESIZE
             self.coords[i] = (x, y)
 
-    def renderPieces(self):  # goes through 1D board array and renders pieces found
+    # redraws the squares whose piece changed since they were drawn and the squares that were highlighted
+    def renderPieces(self):
         boardList = self.boardObj.board
-        for i, piece in enumerate(boardList):
-            if piece == ".":  # "." denotes an empty square
-                continue
-            (x, y) = self.coords[i]
-            if piece not in self.pieceImages:  # should never happen unless there's a bug in the board's code
+        changed = {i for i in range(64) if boardList[i] != self.drawnBoard[i]} | self.markedSquares
+        self.markedSquares = set()
+        for i in changed:
+            if boardList[i] != "." and boardList[i] not in self.pieceImages:  # should never happen unless there's a bug in the board's code
                 print("board invalid")
                 return
+            self.drawSquare(i, boardList[i])
+        self.drawnBoard = boardList
+
+    # draws one square from the background, or filled with highlightColor, and the piece on it
+    def drawSquare(self, index, piece, highlightColor=None):
+        x, y = self.coords[index]
+        tile = pygame.Rect(x, y, self.TILESIZE, self.TILESIZE)
+        if highlightColor is None:
+            self.WIN.blit(self.background, tile, tile)
+        else:
+            pygame.draw.rect(self.WIN, highlightColor, tile)
+        if piece != ".":
             self.WIN.blit(self.pieceImages[piece], (x, y))
-        pygame.display.update()
+        self.dirtyRects.append(tile)
 
+    # returns a surface of the size of the board with the checker pattern of the squares
     def checkerPattern(self):
         LIGHTCOLOR = (240, 217, 181)  # color of light square
         DARKCOLOR = (181, 136, 99)  # color of dark square
         # put in list to easily alternate with modulo
         colors = [LIGHTCOLOR, DARKCOLOR]
+        background = pygame.Surface((self.BOARDSIZE, self.BOARDSIZE)).convert()
         for col in range(8):
             for row in range(8):
                 tile = pygame.Rect(row * self.TILESIZE, col *
@@ -121,8 +280,8 @@ class GUI:
                     color = colors[(col + row) % 2]
                 else:
                     color = colors[1 - ((col + row) % 2)]
-                pygame.draw.rect(self.WIN, color, tile)
-        pygame.display.update()
+                pygame.draw.rect(background, color, tile)
+        return background
 
     def renderGameInfo(self):
         kingIndex = self.boardObj.bitboards["K"] if self.whitesTurn else self.boardObj.bitboards["k"]
@@ -131,21 +290,29 @@ class GUI:
         y = self.BOARDSIZE
         infoBackground = pygame.Rect(0, y, self.BOARDSIZE, self.TILESIZE)
         pygame.draw.rect(self.WIN, (200, 200, 200), infoBackground)
-        font = pygame.font.Font(pygame.font.get_default_font(), 25)
-        if checkmate == -1:
-            text = font.render("Checkmate", True, (0, 0, 0))
+        if checkmate == cb.CHECKMATE:
+            message = "Checkmate"
+        elif checkmate == cb.STALEMATE:
+            message = "Stalemate"
         else:
             turn = "White" if self.whitesTurn else "Black"
-            text = font.render(f"{turn}'s turn", True, (0, 0, 0))
+            message = f"{turn}'s turn"
+        if message not in self.textCache:
+            self.textCache[message] = self.infoFont.render(message, True, (0, 0, 0))
+        text = self.textCache[message]
         text_rect = text.get_rect(
             center=(self.SCREENWIDTH / 2, (self.TILESIZE / 2) + self.BOARDSIZE))
         self.WIN.blit(text, text_rect)
-        pygame.display.update()
+        self.dirtyRects.append(infoBackground)
         return True
 
+    # draws the whole board again
     def updateScreen(self):
-        self.checkerPattern()
+        self.WIN.blit(self.background, (0, 0))
+        self.drawnBoard = ["."] * 64
+        self.markedSquares = set()
         self.renderPieces()
+        self.dirtyRects.append(pygame.Rect(0, 0, self.BOARDSIZE, self.BOARDSIZE))
 
     def isMakingMove(self, index):
         if self.selected is None:
@@ -158,27 +325,22 @@ class GUI:
             return False
         return index in self.legalMoves
 
-    def makeMove(self, start, dest):
-        self.boardObj.makeMove(start, dest)
-        self.updateScreen()
-        pygame.display.update()
+    def makeMove(self, start, dest, promotion=cb.QUEEN):
+        self.boardObj.makeMove(start, dest, promotion=promotion)
+        self.renderPieces()
 
     def selectTile(self, index):
         DARKSELECT = (100, 111, 64)
         LIGHTSELECT = (130, 151, 105)
-        self.updateScreen()
-        x, y = self.coords[index]
-        tile = pygame.Rect(x, y, self.TILESIZE, self.TILESIZE)
+        # takes the highlight off the squares of the previous selection
+        self.renderPieces()
         if index % 2:
             color = DARKSELECT
         else:
             color = LIGHTSELECT
-        pygame.draw.rect(self.WIN, color, tile)
-        piece = self.boardObj.board[index]
-        if piece != ".":
-            self.WIN.blit(self.pieceImages[piece], (x, y))
-        self.legalMoves = self.bitBoardToIndexes(
-            self.boardObj.legalMoves(index))
+        self.drawSquare(index, self.drawnBoard[index], color)
+        self.markedSquares.add(index)
+        self.legalMoves = [cb.moveEnd(move) for move in self.boardObj.cachedLegalMoves() if cb.moveStart(move) == index]
         self.selected = index
 
         if self.whitesTurn and self.boardObj.board[self.selected].isupper() or not self.whitesTurn and self.boardObj.board[self.selected].islower():
@@ -189,8 +351,8 @@ class GUI:
                 circleY += (self.TILESIZE // 2)
                 pygame.draw.circle(self.WIN, DARKSELECT,
                                 (circleX, circleY), radius)
-
-        pygame.display.update()
+                self.markedSquares.add(l)
+                self.dirtyRects.append(pygame.Rect(self.coords[l], (self.TILESIZE, self.TILESIZE)))
 
     def mousePosToIndex(self, mousePos):
         if mousePos[0] > self.BOARDSIZE or mousePos[1] > self.BOARDSIZE:
@@ -0,0 +1,141 @@
+import argparse
+import multiprocessing
+import os
+import time
+import chessboard as cb
+import ai
+import transposition
+
+# Lazy SMP: several processes search the same root position at once and share one transposition table in shared
+# memory. They do not talk to each other while searching; each one finds the entries the others stored in the table,
+# so the search of the main process reaches a depth faster. Half of the helpers start one depth deeper than the main
+# search, so the processes are not all searching the same depth at the same time.
+#   https://www.chessprogramming.org/Lazy_SMP
+
+
+# Runs in each helper process: attaches to the shared table and searches every job it receives on connection until the
+# stop flag is set, then sends back (bestMove, score, depth, nodes). A job of None ends the process.
+def helperMain(connection, ttName, ttSizeMB, stopFlag):
+    tt = transposition.TranspositionTable(ttSizeMB, name=ttName)
+    helper = ai.AI(False, tt=tt)
+    helper.stopFlag = stopFlag
+    while True:
+        job = connection.recv()
+        if job is None:
+            break
+        board, generation, startDepth, maxDepth = job
+        helper.boardObj = board
+        helper.isBlack = not board.whiteToMove
+        # startSearch() moves the table to the next generation, the same one the main process moves it to
+        tt.generation = generation
+        move, score, depth = helper.search(max_depth=maxDepth, start_depth=startDepth)
+        connection.send((move, score, depth, helper.nodes + helper.qnodes))
+    tt.close()
+    connection.close()
+
+
+class ParallelSearch:
+
+    # Searches on boardObj (or a new Board in the starting position) with the given number of processes: the calling
+    # process and workers - 1 helper processes that are started here and kept for every search. close() ends them and
+    # frees the shared table, so use the object in a with statement or call close() when done.
+    def __init__(self, workers=None, ttSizeMB=64, boardObj=None):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.tt = transposition.TranspositionTable(ttSizeMB, shared=True)
+        self.ai = ai.AI(False, tt=self.tt, boardObj=boardObj)
+        self.stopFlag = multiprocessing.RawValue('b', 0)
+        self.helpers = []
+        for index in range(self.workers - 1):
+            connection, helperConnection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=helperMain, daemon=True,
+                                              args=(helperConnection, self.tt.name, ttSizeMB, self.stopFlag))
+            process.start()
+            helperConnection.close()
+            self.helpers.append((connection, process))
+        # positions searched by all processes in the last search
+        self.nodes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def boardObj(self):
+        return self.ai.boardObj
+
+    # Same as AI.search for the side to move of the board. The budget applies to the main process, whose iterations
+    # decide when the search is over; max_nodes only counts its positions. The result is the one of the process that
+    # completed the deepest iteration, the main process winning ties.
+    def search(self, time_ms=None, max_nodes=None, max_depth=64, progress=None):
+        board = self.ai.boardObj.copy()
+        board.moveStack = []
+        self.ai.isBlack = not board.whiteToMove
+        self.stopFlag.value = 0
+        for index, (connection, process) in enumerate(self.helpers):
+            startDepth = 2 if index % 2 == 0 else 1
+            connection.send((board, self.tt.generation, startDepth, max_depth))
+        result = self.ai.search(time_ms, max_nodes, max_depth, progress)
+        self.stopFlag.value = 1
+        self.nodes = self.ai.nodes + self.ai.qnodes
+        for connection, process in self.helpers:
+            move, score, depth, nodes = connection.recv()
+            self.nodes += nodes
+            if move is not None and depth > result[2]:
+                result = (move, score, depth)
+        return result
+
+    # asks a running search to stop, see AI.stop
+    def stop(self):
+        self.ai.stop()
+
+    # withdraws a stop before the next search, see AI.clearStop
+    def clearStop(self):
+        self.ai.clearStop()
+
+    def close(self):
+        for connection, process in self.helpers:
+            connection.send(None)
+        for connection, process in self.helpers:
+            process.join()
+            connection.close()
+        self.helpers = []
+        self.tt.close()
+
+
+# Searches the position to the given depth with each worker count and prints the time the main process took to
+# complete the depth, the positions searched by all processes and the nodes per second. Returns [(workers, seconds,
+# nodes)].
+def benchmark(fen, depth, workerCounts, ttSizeMB=64):
+    results = []
+    for workers in workerCounts:
+        board = cb.Board()
+        board.fen2Board(fen)
+        with ParallelSearch(workers, ttSizeMB, board) as search:
+            start = time.perf_counter()
+            move, score, reached = search.search(max_depth=depth)
+            elapsed = time.perf_counter() - start
+            results.append((workers, elapsed, search.nodes))
+            speedup = results[0][1] / elapsed if elapsed > 0 else 0
+            print(f"{workers:>3} workers  depth {reached}  {elapsed:8.3f}s  {search.nodes:>10} nodes  "
+                  f"{int(search.nodes / elapsed) if elapsed > 0 else 0:>8} nps  {speedup:5.2f}x  {cb.move2Uci(move)} {score}")
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="time-to-depth and nodes per second of the parallel search by worker count")
+    parser.add_argument("--fen", default="r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+                        help="position to search")
+    parser.add_argument("--depth", type=int, default=5, help="depth to search to (default 5)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4],
+                        help="worker counts to compare (default 1 2 4)")
+    parser.add_argument("--hash", type=int, default=64, help="transposition table size in MB (default 64)")
+    options = parser.parse_args(args)
+    print(f"{os.cpu_count()} cpus")
+    benchmark(options.fen, options.depth, options.workers, options.hash)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
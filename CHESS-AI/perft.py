@@ -0,0 +1,222 @@
+import argparse
+import time
+from array import array
+import chessboard as cb
+import pgn
+
+# Positions with known perft node counts, as (name, fen, {depth: nodes}).
+# The counts are the standard published ones.
+#   https://www.chessprogramming.org/Perft_Results
+# The castling and promotion positions are from Martin Sedlak's perft suite, with the counts of the shallower depths
+# checked against python-chess.
+POSITIONS = [
+    ("startpos", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+     {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624, 6: 11030083}),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+    ("promotion", "n1n5/PPPk4/8/8/8/8/4Kppp/5N1N b - - 0 1",
+     {1: 24, 2: 496, 3: 9483, 4: 182838, 5: 3605103, 6: 71179139}),
+    ("shortCastlingGivesCheck", "5k2/8/8/8/8/8/8/4K2R w K - 0 1",
+     {1: 15, 2: 66, 3: 1198, 4: 6399, 5: 120330, 6: 661072}),
+    ("longCastlingGivesCheck", "3k4/8/8/8/8/8/8/R3K3 w Q - 0 1",
+     {1: 16, 2: 71, 3: 1286, 4: 7418, 5: 141077, 6: 803711}),
+    ("castlingRights", "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1",
+     {1: 26, 2: 1141, 3: 27826, 4: 1274206}),
+    ("castlingPrevented", "r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1",
+     {1: 44, 2: 1494, 3: 50509, 4: 1720476}),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+    ("illegalEnpassant1", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1",
+     {1: 18, 2: 92, 3: 1670, 4: 10138, 5: 185429}),
+    ("illegalEnpassant2", "8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1",
+     {1: 13, 2: 102, 3: 1266, 4: 10276, 5: 135655}),
+    ("enpassantGivesCheck", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1",
+     {1: 15, 2: 126, 3: 1928, 4: 13931}),
+    ("discoveredCheck", "8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1",
+     {1: 29, 2: 165, 3: 5160}),
+    ("stalemateAndCheckmate", "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1",
+     {1: 37, 2: 183, 3: 6559, 4: 23527}),
+    ("promoteOutOfCheck", "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1",
+     {1: 11, 2: 133, 3: 1442, 4: 19174, 5: 266199, 6: 3821001}),
+    ("promoteToGiveCheck", "4k3/1P6/8/8/8/8/K7/8 w - - 0 1",
+     {1: 9, 2: 40, 3: 472, 4: 2661, 5: 38983, 6: 217342}),
+    ("underpromoteToGiveCheck", "8/P1k5/K7/8/8/8/8/8 w - - 0 1",
+     {1: 6, 2: 27, 3: 273, 4: 1329, 5: 18135, 6: 92683}),
+    ("selfStalemate", "K1k5/8/P7/8/8/8/8/8 w - - 0 1",
+     {1: 2, 2: 6, 3: 13, 4: 63, 5: 382, 6: 2217}),
+    ("stalemateAfterPromotion", "8/k1P5/8/1K6/8/8/8/8 w - - 0 1",
+     {1: 10, 2: 25, 3: 268, 4: 926, 5: 10857, 6: 43261, 7: 567584}),
+]
+
+# SAN moves read from a game record, as (name, fen, san, uci of the move or None when it is illegal). Illegal moves
+# must make Game.replay raise ValueError, so a corrupt game is not read into a book or analysis.
+SANCHECKS = [
+    ("pinnedKnight", "4k3/4r3/8/8/8/8/4N3/4K3 w - - 0 1", "Nc3", None),
+    ("unpinnedKnight", "4k3/3r4/8/8/8/8/4N3/4K3 w - - 0 1", "Nc3", "e2c3"),
+    ("kingIntoCheck", "4k3/4r3/8/8/8/8/8/3K4 w - - 0 1", "Ke2", None),
+    ("kingStep", "4k3/4r3/8/8/8/8/8/3K4 w - - 0 1", "Kc2", "d1c2"),
+    ("pinnedOfTwoKnights", "4k3/4r3/8/8/8/8/4N3/1N2K3 w - - 0 1", "Nc3", "b1c3"),
+]
+
+
+# counts the leaf nodes of the tree of legal moves to the given depth
+# the last ply only counts the moves instead of making them (bulk counting)
+# the moves of each ply are generated into buffers[depth], an array('H') that is reused for every position at that depth
+def perft(board, depth, buffers=None):
+    if depth == 0:
+        return 1
+    if buffers is None:
+        buffers = [array('H') for ply in range(depth + 1)]
+    moves = buffers[depth]
+    del moves[:]
+    board.generateLegalMoves(None, moves)
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        board.push(move)
+        nodes += perft(board, depth - 1, buffers)
+        board.pop()
+    return nodes
+
+
+# perft that remembers the node count of every (position, depth) it has counted, so transpositions are counted once
+# the table is a dict keyed by (zobrist key, depth) that is cleared when it holds more than maxEntries counts
+def hashedPerft(board, depth, table=None, maxEntries=1000000):
+    if table is None:
+        table = {}
+    if depth <= 1:
+        return perft(board, depth)
+    key = (board.zobristKey, depth)
+    if key in table:
+        return table[key]
+    nodes = 0
+    for move in board.generateLegalMoves():
+        board.push(move)
+        nodes += hashedPerft(board, depth - 1, table, maxEntries)
+        board.pop()
+    if len(table) >= maxEntries:
+        table.clear()
+    table[key] = nodes
+    return nodes
+
+
+# returns [(move, nodes)] with the perft count below each legal move of the position
+def divide(board, depth, hashed=False):
+    results = []
+    table = {}
+    for move in board.generateLegalMoves():
+        board.push(move)
+        if hashed:
+            nodes = hashedPerft(board, depth - 1, table)
+        else:
+            nodes = perft(board, depth - 1)
+        board.pop()
+        results.append((move, nodes))
+    return results
+
+
+# Yields (name, fen, {depth: nodes}) for each position of an EPD file that gives its perft counts as the operations
+# D1, D2, ..., the format of the perftsuite.epd files that come with many engines. The name is the id operation, or
+# the line number.
+def epdPositions(path):
+    with open(path, "r") as epdFile:
+        for number, line in enumerate(epdFile, 1):
+            if not line.strip() or line.startswith("#"):
+                continue
+            fen, operations = cb.splitEpd(line)
+            expected = {int(opcode[1:]): int(operand) for opcode, operand in operations.items()
+                        if opcode[:1] == "D" and opcode[1:].isdigit()}
+            yield operations.get("id", f"line {number}"), fen, expected
+
+
+# Runs perft on every position of the catalogue up to maxDepth and prints the node count, time and nodes per second of
+# each. Returns the number of counts that did not match the expected ones.
+def runSuite(positions=POSITIONS, maxDepth=3, hashed=False):
+    board = cb.Board()
+    failures = 0
+    totalNodes = 0
+    totalTime = 0
+    for name, fen, expected in positions:
+        board.fen2Board(fen)
+        for depth in sorted(expected):
+            if depth > maxDepth:
+                break
+            start = time.perf_counter()
+            nodes = hashedPerft(board, depth) if hashed else perft(board, depth)
+            elapsed = time.perf_counter() - start
+            totalNodes += nodes
+            totalTime += elapsed
+            status = "ok" if nodes == expected[depth] else f"FAIL (expected {expected[depth]})"
+            if nodes != expected[depth]:
+                failures += 1
+            print(f"{name:<24} depth {depth}  {nodes:>10} nodes  {elapsed:8.3f}s  {nodesPerSecond(nodes, elapsed):>10} nps  {status}")
+    print(f"total {totalNodes} nodes in {totalTime:.3f}s, {nodesPerSecond(totalNodes, totalTime)} nps, {failures} failed")
+    return failures
+
+
+# Replays the move of every SAN check and prints whether it was read as expected. Returns the number that were not.
+def runSanChecks(checks=SANCHECKS):
+    failures = 0
+    for name, fen, san, expected in checks:
+        game = pgn.Game({"FEN": fen}, [san], "*")
+        try:
+            uci = cb.move2Uci(next(game.replay())[1])
+        except ValueError:
+            uci = None
+        status = "ok" if uci == expected else f"FAIL (expected {expected or 'illegal'})"
+        if uci != expected:
+            failures += 1
+        print(f"{name:<24} {san:<6} {uci or 'illegal':<8} {status}")
+    print(f"{len(checks)} SAN checks, {failures} failed")
+    return failures
+
+
+def nodesPerSecond(nodes, seconds):
+    if seconds <= 0:
+        return 0
+    return int(nodes / seconds)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="perft move generation benchmark and correctness suite")
+    parser.add_argument("--depth", type=int, default=3, help="deepest depth to count (default 3)")
+    parser.add_argument("--fen", help="count this position instead of the catalogue")
+    parser.add_argument("--position", action="append", help="only run the catalogue positions with this name")
+    parser.add_argument("--epd", help="run the positions of this EPD file (with D1, D2, ... counts) instead of the catalogue")
+    parser.add_argument("--divide", action="store_true", help="with --fen, print the count below each move")
+    parser.add_argument("--hash", action="store_true", help="use hashed perft")
+    options = parser.parse_args(args)
+
+    if options.fen:
+        board = cb.Board()
+        board.fen2Board(options.fen)
+        start = time.perf_counter()
+        if options.divide:
+            nodes = 0
+            for move, count in divide(board, options.depth, options.hash):
+                print(f"{cb.move2Uci(move)}: {count}")
+                nodes += count
+        else:
+            nodes = hashedPerft(board, options.depth) if options.hash else perft(board, options.depth)
+        elapsed = time.perf_counter() - start
+        print(f"depth {options.depth}  {nodes} nodes  {elapsed:.3f}s  {nodesPerSecond(nodes, elapsed)} nps")
+        return 0
+
+    positions = POSITIONS if options.epd is None else epdPositions(options.epd)
+    if options.position:
+        positions = [position for position in positions if position[0] in options.position]
+    failures = runSuite(positions, options.depth, options.hash)
+    if options.epd is None and not options.position:
+        failures += runSanChecks()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,177 @@
+import argparse
+import re
+import sys
+import time
+import chessboard as cb
+
+# Streaming PGN reader: readGames() reads a file of games a line at a time and yields one Game per game, so archives of
+# millions of games are never held in memory. A Game holds the SAN of its moves; Game.replay() resolves them against a
+# Board (see Board.san2Move) only when the positions are wanted, and Game.toPgn() writes a game back out.
+#   python pgn.py games.pgn          prints the number of games and moves read per second
+
+STARTFEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+# the tags every game is written with, in this order and before any other tags
+SEVENTAGROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+# movetext lines are wrapped to this many characters
+PGNLINELENGTH = 80
+
+# a tag pair such as [White "Carlsen, Magnus"], matching up to the last quote so unescaped quotes in values are kept
+TAGPATTERN = re.compile(r'\[\s*(\w+)\s*"(.*)"\s*\]')
+# the tokens of the movetext: comment and variation brackets, line comments, NAGs, results, move numbers and moves
+TOKENPATTERN = re.compile(r'[{}();]|\$\d+|1-0|0-1|1/2-1/2|\*|\d+\.+|[^\s{}();$]+')
+
+
+class Game:
+
+    # headers is {tag: value}, moves the SAN of the moves of the main line (variations and comments are dropped) and
+    # result the result token at the end of the movetext
+    def __init__(self, headers, moves, result):
+        self.headers = headers
+        self.moves = moves
+        self.result = result
+
+    # the FEN the game starts from: the FEN tag if there is one and the starting position otherwise
+    def startFen(self):
+        return self.headers.get("FEN", STARTFEN)
+
+    # Plays the game on board (a new Board unless one is given) and yields (board, move) for each move, with the board
+    # in the position before the move; the move is made when the next one is asked for, so after the last one the board
+    # is in the final position. Raises ValueError at a move that is not a legal move of the position.
+    def replay(self, board=None):
+        if board is None:
+            board = cb.Board()
+        board.fen2Board(self.startFen())
+        for ply, san in enumerate(self.moves):
+            move = board.san2Move(san)
+            if move is None:
+                raise ValueError(f"illegal move {san!r} at ply {ply + 1} of {self.headers.get('White', '?')} - "
+                                 f"{self.headers.get('Black', '?')}")
+            yield board, move
+            board.push(move)
+
+    # Returns the game in PGN: the seven tag roster ("?" for missing tags) and then the other tags, and the moves numbered
+    # from the move number and side to move of the start position, ending with the result and an empty line.
+    def toPgn(self):
+        headers = dict(self.headers, Result=self.result)
+        tags = list(SEVENTAGROSTER) + [tag for tag in headers if tag not in SEVENTAGROSTER]
+        lines = []
+        for tag in tags:
+            value = str(headers.get(tag, "?")).replace("\\", "\\\\").replace('"', '\\"')
+            lines.append(f'[{tag} "{value}"]')
+        lines.append("")
+
+        fields = self.startFen().split()
+        whiteToMove = len(fields) < 2 or fields[1] == "w"
+        number = int(fields[5]) if len(fields) > 5 and fields[5].isdigit() else 1
+        tokens = []
+        for san in self.moves:
+            if whiteToMove:
+                tokens.append(f"{number}.")
+            elif not tokens:
+                tokens.append(f"{number}...")
+            tokens.append(san)
+            if not whiteToMove:
+                number += 1
+            whiteToMove = not whiteToMove
+        tokens.append(self.result)
+        line = ""
+        for token in tokens:
+            if line and len(line) + 1 + len(token) > PGNLINELENGTH:
+                lines.append(line)
+                line = token
+            else:
+                line = f"{line} {token}" if line else token
+        lines.append(line)
+        return "\n".join(lines) + "\n\n"
+
+
+# Yields a Game for each game of the stream, an iterable of lines such as an open file. A game ends at its result or
+# where the tags of the next game start. Comments ({...} and ; to the end of the line), variations, NAGs and move
+# numbers are skipped while reading.
+def readGames(stream):
+    headers = {}
+    moves = []
+    inComment = False
+    variationDepth = 0
+    for line in stream:
+        if not inComment:
+            stripped = line.strip()
+            if stripped.startswith("["):
+                if moves:
+                    yield Game(headers, moves, "*")
+                    headers, moves, variationDepth = {}, [], 0
+                match = TAGPATTERN.match(stripped)
+                if match:
+                    headers[match.group(1)] = match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+                continue
+            if stripped.startswith("%"):
+                continue
+        for token in TOKENPATTERN.findall(line):
+            if inComment:
+                inComment = token != "}"
+            elif token == "{":
+                inComment = True
+            elif token == ";":
+                break
+            elif token == "(":
+                variationDepth += 1
+            elif token == ")":
+                variationDepth = max(0, variationDepth - 1)
+            elif variationDepth or token[0] == "$" or token[0].isdigit() and token[-1] == ".":
+                continue
+            elif token in RESULTS:
+                yield Game(headers, moves, token)
+                headers, moves = {}, []
+            else:
+                moves.append(token)
+    if headers or moves:
+        yield Game(headers, moves, "*")
+
+
+# Reads every game of the file at path ("-" for standard input), replaying the moves unless replay is False, and
+# prints the games and moves per second. Games with a move that does not fit are counted and skipped.
+# Returns (games, moves, errors, seconds).
+def benchmark(path, replay=True, limit=None, reportEvery=0):
+    stream = sys.stdin if path == "-" else open(path, "r", encoding="utf-8", errors="replace", buffering=1 << 20)
+    board = cb.Board()
+    games = moves = errors = 0
+    start = time.perf_counter()
+    try:
+        for game in readGames(stream):
+            if replay:
+                try:
+                    for position, move in game.replay(board):
+                        moves += 1
+                except ValueError:
+                    errors += 1
+            else:
+                moves += len(game.moves)
+            games += 1
+            if reportEvery and games % reportEvery == 0:
+                elapsed = time.perf_counter() - start
+                print(f"{games} games, {games / elapsed:.0f} games/s", file=sys.stderr)
+            if limit is not None and games >= limit:
+                break
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    elapsed = time.perf_counter() - start
+    print(f"{games} games, {moves} moves, {errors} errors in {elapsed:.3f}s: "
+          f"{games / elapsed if elapsed > 0 else 0:.0f} games/s, {moves / elapsed if elapsed > 0 else 0:.0f} moves/s")
+    return games, moves, errors, elapsed
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="read a PGN file and report games per second")
+    parser.add_argument("input", nargs="?", default="-", help="PGN file (default: standard input)")
+    parser.add_argument("--no-replay", action="store_true", help="only parse the games, do not resolve the moves")
+    parser.add_argument("--limit", type=int, help="stop after this many games")
+    parser.add_argument("--report", type=int, default=0, help="print progress every this many games")
+    options = parser.parse_args(args)
+    games, moves, errors, elapsed = benchmark(options.input, not options.no_replay, options.limit, options.report)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
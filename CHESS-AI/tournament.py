@@ -0,0 +1,233 @@
+import argparse
+import math
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import chessboard as cb
+import ai
+import bitbase
+import book
+import pgn
+
+# Self-play matches between two engine configurations, to check whether a change makes the engine stronger or faster:
+#   python tournament.py --engine1 "name=new,movetime=100" --engine2 "name=old,movetime=100,hash=4" --games 200 \
+#       --openings openings.epd --pgn match.pgn
+# Each opening is played twice, each engine having white once. Games are played in parallel on a pool of worker
+# processes and end in checkmate, stalemate, threefold repetition, the fifty move rule, a lack of mating material or
+# a draw by adjudication after --max-plies plies. The summary gives the score, games per second, the nodes per second of
+# each engine and the Elo difference with its 95% error margin.
+
+# the keys of an engine configuration ("key=value,..." on the command line) and their defaults. movetime, nodes and
+# depth are the budget of every move (see AI.search), hash the transposition table size in MB, book and bitbases
+# whether the engine uses the opening book and endgame bitbases when they are there
+CONFIGDEFAULTS = {"name": None, "movetime": 100, "nodes": None, "depth": 64, "hash": 16, "book": False, "bitbases": False}
+
+# games a match needs before the Elo error margin means anything
+MINMARGINGAMES = 10
+
+# the engine configurations and their AIs in a worker process, set by initWorker
+workerConfigs = None
+workerEngines = None
+
+
+# Returns the configuration of the engine described by spec, e.g. "name=new,movetime=200,hash=32". Raises ValueError
+# for an unknown key or a bad value.
+def parseConfig(spec, name):
+    config = dict(CONFIGDEFAULTS, name=name)
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        key, separator, value = (part.strip() for part in item.partition("="))
+        if key not in CONFIGDEFAULTS or not separator:
+            raise ValueError(f"unknown engine option {item.strip()!r}")
+        if key == "name":
+            config[key] = value
+        elif key in ("book", "bitbases"):
+            config[key] = value.lower() in ("1", "true", "yes", "on")
+        else:
+            config[key] = None if value.lower() == "none" else int(value)
+    return config
+
+
+# Runs once in each worker process: both engines search on the same board, one after the other.
+def initWorker(configs):
+    global workerConfigs, workerEngines
+    workerConfigs = configs
+    board = cb.Board()
+    workerEngines = [ai.AI(False, config["hash"], boardObj=board,
+                           book=book.openBook() if config["book"] else None,
+                           bitbases=bitbase.openBitbases() if config["bitbases"] else None) for config in configs]
+
+
+# True when neither side has the material to mate: only kings, or kings and one knight or bishop
+def insufficientMaterial(board):
+    pieceBbs = board.pieceBbs
+    if pieceBbs[cb.WHITEPAWN] | pieceBbs[cb.BLACKPAWN] | pieceBbs[cb.WHITEROOK] | pieceBbs[cb.BLACKROOK] | \
+            pieceBbs[cb.WHITEQUEEN] | pieceBbs[cb.BLACKQUEEN]:
+        return False
+    return (pieceBbs[cb.WHITE] | pieceBbs[cb.BLACK]).bit_count() <= 3
+
+
+# Returns (result, termination) if the game on board is over and None otherwise. positionCounts holds how often each
+# zobrist key has occurred in the game.
+def gameOver(board, positionCounts, plies, maxPlies):
+    if not board.hasAnyLegalMove():
+        if board.inCheck(not board.whiteToMove):
+            return ("0-1" if board.whiteToMove else "1-0"), "checkmate"
+        return "1/2-1/2", "stalemate"
+    if positionCounts[board.zobristKey] >= 3:
+        return "1/2-1/2", "threefold repetition"
+    if board.halfmoveClock >= 100:
+        return "1/2-1/2", "fifty move rule"
+    if insufficientMaterial(board):
+        return "1/2-1/2", "insufficient material"
+    if plies >= maxPlies:
+        return "1/2-1/2", "adjudication"
+    return None
+
+
+# Plays one game in a worker process from fen, engine white (0 or 1) having white, and returns it as a dict with the
+# SAN moves, the result and how it ended, and the nodes searched and seconds spent by each engine.
+def playGame(gameId, fen, white, maxPlies):
+    board = workerEngines[0].boardObj
+    board.fen2Board(fen)
+    for engine in workerEngines:
+        engine.tt.clear()
+    nodes = [0, 0]
+    seconds = [0.0, 0.0]
+    moves = []
+    positionCounts = {board.zobristKey: 1}
+    while True:
+        over = gameOver(board, positionCounts, len(moves), maxPlies)
+        if over is not None:
+            break
+        index = white if board.whiteToMove else 1 - white
+        engine = workerEngines[index]
+        config = workerConfigs[index]
+        engine.isBlack = not board.whiteToMove
+        start = time.perf_counter()
+        move = engine.search(config["movetime"], config["nodes"], config["depth"])[0]
+        seconds[index] += time.perf_counter() - start
+        nodes[index] += engine.nodes + engine.qnodes
+        moves.append(board.move2San(move))
+        board.push(move)
+        positionCounts[board.zobristKey] = positionCounts.get(board.zobristKey, 0) + 1
+    result, termination = over
+    return {"id": gameId, "fen": fen, "white": white, "moves": moves, "result": result, "termination": termination,
+            "nodes": nodes, "seconds": seconds}
+
+
+# the Elo difference that gives the expected score (from 0 to 1), infinite for 0 and 1
+def scoreToElo(score):
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return 400 * math.log10(score / (1 - score))
+
+
+# Returns (Elo difference, 95% error margin) of a match with the given wins, draws and losses. The margin comes from
+# the standard deviation of the score of a game, as in most engine testing tools. It is None when it can not be told:
+# with fewer than MINMARGINGAMES games, or when every game had the same score and the deviation is 0.
+def eloDifference(wins, draws, losses):
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0, None
+    score = (wins + draws / 2) / games
+    deviation = math.sqrt((wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games)
+    if games < MINMARGINGAMES or deviation == 0:
+        return scoreToElo(score), None
+    margin = 1.96 * deviation / math.sqrt(games)
+    return scoreToElo(score), (scoreToElo(score + margin) - scoreToElo(score - margin)) / 2
+
+
+# Returns the game of a playGame result as a pgn.Game for the PGN file.
+def resultToGame(result, configs, date):
+    headers = {"Event": "Self-play", "Site": "?", "Date": date, "Round": str(result["id"] + 1),
+               "White": configs[result["white"]]["name"], "Black": configs[1 - result["white"]]["name"]}
+    if result["fen"] != pgn.STARTFEN:
+        headers["SetUp"] = "1"
+        headers["FEN"] = result["fen"]
+    headers["Termination"] = result["termination"]
+    return pgn.Game(headers, result["moves"], result["result"])
+
+
+# Plays games games between the two configurations on a pool of workers, each opening (FENs) twice with the colours
+# reversed, and yields the result of each game as it finishes.
+def playMatch(configs, openings, games, workers=None, maxPlies=300):
+    with ProcessPoolExecutor(workers, initializer=initWorker, initargs=(configs,)) as pool:
+        futures = [pool.submit(playGame, gameId, openings[gameId // 2 % len(openings)], gameId % 2, maxPlies)
+                   for gameId in range(games)]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="play a self-play match between two engine configurations")
+    parser.add_argument("--engine1", default="", help='configuration of the first engine, e.g. "name=new,movetime=100"')
+    parser.add_argument("--engine2", default="", help="configuration of the second engine")
+    parser.add_argument("--games", type=int, default=2, help="games to play (default 2)")
+    parser.add_argument("--openings", help="EPD file of opening positions (default: the starting position)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per cpu)")
+    parser.add_argument("--pgn", help="file to write the games to")
+    parser.add_argument("--max-plies", type=int, default=300, help="plies after which a game is drawn (default 300)")
+    options = parser.parse_args(args)
+    try:
+        configs = [parseConfig(options.engine1, "engine1"), parseConfig(options.engine2, "engine2")]
+    except ValueError as error:
+        parser.error(str(error))
+    if configs[0]["name"] == configs[1]["name"]:
+        configs[1]["name"] += "-2"
+    openings = [pgn.STARTFEN]
+    if options.openings:
+        openings = [board.toFen() for board, operations in cb.readEpd(options.openings)]
+        if not openings:
+            parser.error(f"no positions in {options.openings}")
+
+    wins = draws = losses = 0
+    nodes = [0, 0]
+    seconds = [0.0, 0.0]
+    date = time.strftime("%Y.%m.%d")
+    output = open(options.pgn, "w") if options.pgn else None
+    start = time.perf_counter()
+    try:
+        for played, result in enumerate(playMatch(configs, openings, options.games, options.workers,
+                                                  options.max_plies), 1):
+            # the score of engine1
+            score = {"1-0": 1, "0-1": 0}.get(result["result"], 0.5)
+            if result["white"] == 1:
+                score = 1 - score
+            wins += score == 1
+            draws += score == 0.5
+            losses += score == 0
+            for index in range(2):
+                nodes[index] += result["nodes"][index]
+                seconds[index] += result["seconds"][index]
+            if output is not None:
+                output.write(resultToGame(result, configs, date).toPgn())
+                output.flush()
+            print(f"game {result['id'] + 1}: {configs[result['white']]['name']} - "
+                  f"{configs[1 - result['white']]['name']} {result['result']} ({result['termination']}, "
+                  f"{len(result['moves'])} plies)  score {wins + draws / 2}/{played}", file=sys.stderr)
+    finally:
+        if output is not None:
+            output.close()
+    elapsed = time.perf_counter() - start
+
+    games = wins + draws + losses
+    elo, margin = eloDifference(wins, draws, losses)
+    print(f"{configs[0]['name']} vs {configs[1]['name']}: +{wins} ={draws} -{losses} "
+          f"({100 * (wins + draws / 2) / games if games else 0:.1f}%)")
+    if margin is None:
+        print(f"Elo difference {elo:+.1f} +/- n/a")
+    else:
+        print(f"Elo difference {elo:+.1f} +/- {margin:.1f} (95%)")
+    print(f"{games} games in {elapsed:.1f}s, {games / elapsed if elapsed > 0 else 0:.2f} games/s")
+    for index in range(2):
+        nps = nodes[index] / seconds[index] if seconds[index] > 0 else 0
+        print(f"{configs[index]['name']}: {nodes[index]} nodes in {seconds[index]:.1f}s, {nps:.0f} nodes/s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,130 @@
+from array import array
+from multiprocessing import shared_memory
+
+# bound types of a stored score
+# EXACT: the score is the exact value of the position
+# LOWERBOUND: the search failed high (score >= beta), the real value is at least the score
+# UPPERBOUND: the search failed low (score <= alpha), the real value is at most the score
+EXACT = 0
+LOWERBOUND = 1
+UPPERBOUND = 2
+
+# scores are stored with this offset so they fit in 16 unsigned bits
+SCOREOFFSET = 32768
+
+
+class TranspositionTable:
+
+    # The table remembers the result of searching a position, keyed by the zobrist key of the Board.
+    # It is split into buckets of two slots. The first slot of a bucket is depth-preferred: it is only overwritten by
+    # a search that is at least as deep, by the same position or by an entry from a previous search. The second slot
+    # is always replaced, so recent positions are remembered even when the first slot holds a deep entry.
+    #
+    # Each slot is two unsigned 64 bit integers in flat arrays, so the size in memory is exactly sizeMB:
+    #   data = move (16 bits) | score + SCOREOFFSET (16 bits) | depth (8 bits) | bound (2 bits) | generation (6 bits)
+    #   key  = zobrist key XOR data
+    # Storing the key XOR'd with the data means a slot whose two halves were not written together never matches.
+    # Moves are the 16 bit moves of the Board (0 means no move), see chessboard.encodeMove.
+    #
+    # With shared=True the arrays live in a block of multiprocessing.shared_memory instead, and other processes can use
+    # the same table by creating a TranspositionTable with the name of the block. No locks are taken: two processes
+    # writing the same slot at once can leave its halves from different writes, which the XOR above turns into a miss.
+    # The process that created the block must call close() when done with it, which also frees it.
+
+    def __init__(self, sizeMB=16, shared=False, name=None):
+        self.numBuckets = max(1, (sizeMB * 1024 * 1024) // 32)
+        self.sharedMemory = None
+        self.ownsSharedMemory = False
+        if name is not None:
+            self.sharedMemory = shared_memory.SharedMemory(name=name)
+        elif shared:
+            self.sharedMemory = shared_memory.SharedMemory(create=True, size=32 * self.numBuckets)
+            self.ownsSharedMemory = True
+        self.name = None if self.sharedMemory is None else self.sharedMemory.name
+        self.allocate()
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    # creates empty keys and data arrays, or views of the shared memory block
+    def allocate(self):
+        if self.sharedMemory is None:
+            self.keys = array('Q', bytes(16 * self.numBuckets))
+            self.data = array('Q', bytes(16 * self.numBuckets))
+        else:
+            half = 16 * self.numBuckets
+            self.keys = self.sharedMemory.buf[:half].cast('Q')
+            self.data = self.sharedMemory.buf[half:2 * half].cast('Q')
+
+    # removes every entry and resets the counters
+    def clear(self):
+        if self.sharedMemory is None:
+            self.allocate()
+        else:
+            self.sharedMemory.buf[:32 * self.numBuckets] = bytes(32 * self.numBuckets)
+        self.generation = 0
+        self.resetStats()
+
+    # lets go of the shared memory block, and frees it if this table created it
+    def close(self):
+        if self.sharedMemory is None:
+            return
+        self.keys.release()
+        self.data.release()
+        self.sharedMemory.close()
+        if self.ownsSharedMemory:
+            self.sharedMemory.unlink()
+        self.sharedMemory = None
+
+    def resetStats(self):
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    # called before each search so that the depth-preferred slots filled by older searches can be replaced
+    def newSearch(self):
+        self.generation = (self.generation + 1) & 63
+
+    # returns (depth, score, bound, move) of the position with the given zobrist key or None if it is not stored
+    def probe(self, key):
+        self.probes += 1
+        slot = (key % self.numBuckets) << 1
+        keys, data = self.keys, self.data
+        for i in (slot, slot + 1):
+            entry = data[i]
+            if keys[i] ^ entry == key and entry:
+                self.hits += 1
+                return ((entry >> 32) & 255, ((entry >> 16) & 65535) - SCOREOFFSET, (entry >> 40) & 3, entry & 65535)
+        return None
+
+    def store(self, key, depth, score, bound, move):
+        slot = (key % self.numBuckets) << 1
+        keys, data = self.keys, self.data
+        entry = data[slot]
+        # keep the move of a previous search of this position if this search did not find one
+        if not move and keys[slot] ^ entry == key:
+            move = entry & 65535
+        if not entry or keys[slot] ^ entry == key or (entry >> 32) & 255 <= depth or (entry >> 42) != self.generation:
+            if entry and keys[slot] ^ entry != key:
+                self.overwrites += 1
+        else:
+            slot += 1
+            if data[slot] and keys[slot] ^ data[slot] != key:
+                self.overwrites += 1
+        newEntry = move | (score + SCOREOFFSET) << 16 | min(depth, 255) << 32 | bound << 40 | self.generation << 42
+        data[slot] = newEntry
+        keys[slot] = key ^ newEntry
+        self.stores += 1
+
+    # fraction of probes that found their position
+    def hitRate(self):
+        if self.probes == 0:
+            return 0.0
+        return self.hits / self.probes
+
+    # fraction of the slots that are in use
+    def usage(self):
+        return sum(1 for entry in self.data if entry) / len(self.data)
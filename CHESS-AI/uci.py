@@ -0,0 +1,240 @@
+import argparse
+import sys
+import threading
+import time
+import chessboard as cb
+import ai
+import bitbase
+import book
+import transposition
+
+# UCI (Universal Chess Interface) front end, so the engine can be run by chess GUIs and match runners:
+#   http://wbec-ridderkerk.nl/html/UCIProtocol.html
+#   python uci.py
+# Commands are read on the calling thread and every search runs on a thread of its own, so stop, isready and ponderhit
+# are answered while the engine is thinking. The output is written under a lock, as both threads write to it.
+
+ENGINENAME = "SCE Chess AI"
+ENGINEAUTHOR = "SCE Development"
+
+# milliseconds kept back from the clock for the time it takes to send the move
+MOVEOVERHEAD = 50
+# moves the remaining time is shared between when the GUI does not say how many are left before the next time control
+DEFAULTMOVESTOGO = 30
+# the go parameters that take a number
+GOPARAMETERS = ("wtime", "btime", "winc", "binc", "movestogo", "movetime", "nodes", "depth")
+
+STARTFEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+
+# Returns the milliseconds to search with the go parameters given: the movetime if there is one, otherwise a share of
+# the side to move's remaining time plus most of its increment, and None for a search without a time limit.
+def timeBudget(parameters, whiteToMove):
+    if "movetime" in parameters:
+        return parameters["movetime"]
+    remaining = parameters.get("wtime" if whiteToMove else "btime")
+    if remaining is None:
+        return None
+    increment = parameters.get("winc" if whiteToMove else "binc", 0)
+    budget = remaining // max(1, parameters.get("movestogo", DEFAULTMOVESTOGO)) + increment * 3 // 4
+    return max(1, min(budget, remaining - MOVEOVERHEAD))
+
+
+# the UCI score of a search score: "mate N" (in moves, negative when the engine is mated) or "cp N"
+def uciScore(score):
+    if abs(score) > ai.MATESCORE - 1000:
+        moves = (ai.MATESCORE - abs(score) + 1) // 2
+        return f"mate {moves if score > 0 else -moves}"
+    return f"cp {score}"
+
+
+class UciEngine:
+
+    # output is the stream the answers are written to
+    def __init__(self, output=sys.stdout, ttSizeMB=16):
+        self.output = output
+        self.outputLock = threading.Lock()
+        self.board = cb.Board()
+        self.board.fen2Board(STARTFEN)
+        self.ttSizeMB = ttSizeMB
+        self.ai = ai.AI(False, ttSizeMB, bitbases=bitbase.openBitbases())
+        self.searchThread = None
+        self.searchStart = 0
+        # a pondering or infinite search only gives its move after stop (or ponderhit): the search thread waits for
+        # release when it finishes early
+        self.release = threading.Event()
+        self.waitForRelease = False
+        self.pondering = False
+        # (time budget, nodes) the search switches to at ponderhit
+        self.ponderBudget = (None, None)
+
+    def send(self, line):
+        with self.outputLock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    # Reads commands from the stream (standard input unless given) until quit or the end of the stream.
+    # Returns the exit status.
+    def run(self, stream=None):
+        if stream is None:
+            stream = sys.stdin
+        for line in stream:
+            if not self.command(line):
+                break
+        self.stopSearch()
+        return 0
+
+    # carries out one command, returns False for quit
+    def command(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        name, arguments = tokens[0], tokens[1:]
+        if name == "uci":
+            self.send(f"id name {ENGINENAME}")
+            self.send(f"id author {ENGINEAUTHOR}")
+            self.send(f"option name Hash type spin default {self.ttSizeMB} min 1 max 1024")
+            self.send("option name Ponder type check default false")
+            self.send("option name OwnBook type check default false")
+            self.send("uciok")
+        elif name == "isready":
+            self.send("readyok")
+        elif name == "setoption":
+            self.stopSearch()
+            self.setOption(arguments)
+        elif name == "ucinewgame":
+            self.stopSearch()
+            self.ai.tt.clear()
+        elif name == "position":
+            self.stopSearch()
+            self.setPosition(arguments)
+        elif name == "go":
+            self.stopSearch()
+            self.go(arguments)
+        elif name == "stop":
+            self.stopSearch()
+        elif name == "ponderhit":
+            self.ponderHit()
+        elif name == "quit":
+            return False
+        elif name not in ("debug", "register"):
+            self.send(f"info string unknown command {name}")
+        return True
+
+    # setoption name <name> [value <value>], names may have spaces
+    def setOption(self, arguments):
+        if "name" not in arguments:
+            return
+        split = arguments.index("value") if "value" in arguments else len(arguments)
+        name = " ".join(arguments[arguments.index("name") + 1:split]).lower()
+        value = " ".join(arguments[split + 1:])
+        if name == "hash" and value.isdigit():
+            self.ttSizeMB = max(1, int(value))
+            self.ai.tt = transposition.TranspositionTable(self.ttSizeMB)
+        elif name == "ownbook":
+            if self.ai.book is not None:
+                self.ai.book.close()
+            self.ai.book = book.openBook() if value.lower() == "true" else None
+
+    # position [startpos | fen <fen>] [moves <move> ...]
+    def setPosition(self, arguments):
+        split = arguments.index("moves") if "moves" in arguments else len(arguments)
+        if arguments[:1] == ["fen"]:
+            fen = " ".join(arguments[1:split])
+        else:
+            fen = STARTFEN
+        try:
+            self.board.fen2Board(fen)
+        except ValueError as error:
+            self.send(f"info string {error}")
+            self.board.fen2Board(STARTFEN)
+            return
+        for uci in arguments[split + 1:]:
+            move = self.board.uci2Move(uci)
+            if move is None:
+                self.send(f"info string illegal move {uci}")
+                break
+            self.board.push(move)
+
+    # go [ponder] [infinite] [wtime N] [btime N] [winc N] [binc N] [movestogo N] [movetime N] [nodes N] [depth N]
+    def go(self, arguments):
+        parameters = {}
+        for index, token in enumerate(arguments[:-1]):
+            if token in GOPARAMETERS and arguments[index + 1].lstrip("-").isdigit():
+                parameters[token] = int(arguments[index + 1])
+        infinite = "infinite" in arguments
+        self.pondering = "ponder" in arguments
+        budget = None if infinite else timeBudget(parameters, self.board.whiteToMove)
+        nodes = parameters.get("nodes")
+        self.ponderBudget = (budget, nodes)
+        if self.pondering:
+            # the time only starts to count at ponderhit
+            budget = nodes = None
+        self.waitForRelease = infinite or self.pondering
+        self.release.clear()
+        self.ai.clearStop()
+
+        self.ai.boardObj = self.board.copy()
+        self.ai.isBlack = not self.board.whiteToMove
+        self.searchStart = time.perf_counter()
+        self.searchThread = threading.Thread(target=self.searchWorker,
+                                             args=(budget, nodes, parameters.get("depth", 64)), daemon=True)
+        self.searchThread.start()
+
+    # runs on the search thread and sends the best move when the search is over
+    def searchWorker(self, time_ms, nodes, depth):
+        move = self.ai.search(time_ms, nodes, depth, progress=self.sendInfo)[0]
+        if self.waitForRelease:
+            self.release.wait()
+        board = self.ai.boardObj
+        if move is None:
+            # stopped before the first iteration completed
+            moves = board.generateLegalMoves()
+            move = moves[0] if moves else None
+        if move is None:
+            self.send("bestmove 0000")
+        elif len(self.ai.pv) > 1 and self.ai.pv[0] == move:
+            self.send(f"bestmove {cb.move2Uci(move)} ponder {cb.move2Uci(self.ai.pv[1])}")
+        else:
+            self.send(f"bestmove {cb.move2Uci(move)}")
+
+    # the progress callback of the search: one info line per completed depth
+    def sendInfo(self, depth, score, move, nodes):
+        elapsed = time.perf_counter() - self.searchStart
+        milliseconds = int(elapsed * 1000)
+        nps = int(nodes / elapsed) if elapsed > 0 else 0
+        pv = " ".join(cb.move2Uci(pvMove) for pvMove in self.ai.pv) or cb.move2Uci(move)
+        self.send(f"info depth {depth} score {uciScore(score)} nodes {nodes} nps {nps} time {milliseconds} pv {pv}")
+
+    # The opponent played the move the engine was pondering on: the search goes on as a normal one with the budget of the
+    # go ponder command, counted from the go, so a long ponder gives its move at once.
+    def ponderHit(self):
+        if self.searchThread is None or not self.pondering:
+            return
+        self.pondering = False
+        budget, nodes = self.ponderBudget
+        self.ai.ponderHit(budget, nodes)
+        if budget is not None or nodes is not None:
+            self.waitForRelease = False
+            self.release.set()
+
+    # stops a running search and waits for it to send its move
+    def stopSearch(self):
+        if self.searchThread is None:
+            return
+        self.ai.stop()
+        self.pondering = False
+        self.release.set()
+        self.searchThread.join()
+        self.searchThread = None
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="run the engine as a UCI engine on standard input and output")
+    parser.add_argument("--hash", type=int, default=16, help="transposition table size in MB (default 16)")
+    options = parser.parse_args(args)
+    return UciEngine(ttSizeMB=options.hash).run()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())